@@ -40,6 +40,14 @@ def convert_fc_period_to_string(value):
     else:
         raise ValueError(f"The value '{value}' is not a number nor str.")
 
+def lat_descending(da,lat_name='latitude'):
+    ''' Returns da with latitudes running from 90 to -90, as used on the submission grid.
+    Reversing with a slice returns a view rather than a sorted copy. lat_name may be a coordinate on a differently named dimension, e.g. lat on y.
+    '''
+    if da[lat_name].values[0] < da[lat_name].values[-1]:
+        da = da.isel({da[lat_name].dims[0]: slice(None,None,-1)})
+    return da
+
 def check_and_flip_latitudes(da):
     """
     Check if latitudes range from 90 to -90, and flip if necessary.
@@ -70,7 +78,7 @@ def check_and_flip_latitudes(da):
     # Check if latitudes need to be flipped
     if latitude_vals[0] < latitude_vals[-1]:  # If increasing order
         print("Latitudes are in ascending order (first latitude point is bigger than last latitude point); flipping them to descend from 90 to -90.")
-        da = da.sortby(latitude, ascending=False)
+        da = lat_descending(da,name)
     return da
 
 def check_quintile_range(da):
@@ -133,8 +141,8 @@ def check_and_convert_longitudes(ds):
     # Check if longitudes are in the -180 to 180 range
     if np.any(longitude_vals < 0):
         print("Assuming longitudes are in the -180 to 180 range; converting to 0 to 360.")
-        longitudes = (longitudes + 360) % 360  # Convert to 0 to 360 range
-        ds = ds.assign_coords({name: longitudes})  # Update the dataset's longitude coordinates with 0 to 360. 
+        longitudes = (longitude_vals + 360) % 360  # Convert to 0 to 360 range
+        ds = ds.assign_coords({name: longitudes}).sortby(name)  # Update the dataset's longitude coordinates with 0 to 360, running from 0 to 359.
     return ds
 
 def check_data_characteristics(da):
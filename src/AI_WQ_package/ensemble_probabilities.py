@@ -0,0 +1,135 @@
+# script that converts raw ensemble forecasts into quintile probabilities ready for forecast submission.
+import xarray as xr
+import numpy as np
+from AI_WQ_package import check_fc_submission
+from AI_WQ_package import forecast_submission
+from AI_WQ_package import regrid_submission
+
+def grid_values(data):
+    ''' Returns the values of data as a numpy array shaped (lead, 181, 360) on the submission grid, with latitudes from 90 to -90 and longitudes from 0 to 359.
+    data can be a numpy array (assumed to already be ordered this way) or an xarray.DataArray. Longitudes from -180 to 180 are converted to 0 to 360, as in check_and_convert_longitudes,
+    and a ValueError is raised if the coordinates are not those of the submission grid, so an ensemble and climatology on different grids are never compared point by point.
+    '''
+    if isinstance(data,xr.DataArray):
+        latitude_names = ['latitude', 'lat', 'latitudes', 'lat_deg', 'y']
+        longitude_names = ['longitude', 'lon', 'longitudes', 'lon_deg', 'x']
+        lat_name = next((name for name in latitude_names if name in data.dims),None)
+        lon_name = next((name for name in longitude_names if name in data.dims),None)
+        if lat_name is None or lon_name is None:
+            raise ValueError(f"Latitude and longitude dimensions not found. Tried '{latitude_names}' and '{longitude_names}'.")
+        lead_dim = [dim for dim in data.dims if dim not in (lat_name,lon_name)]
+        data = data.transpose(*lead_dim,lat_name,lon_name)
+        data = check_fc_submission.lat_descending(data,lat_name) # view with latitudes from 90 to -90
+        if np.any(data[lon_name].values < 0):
+            data = data.assign_coords({lon_name: (data[lon_name].values+360) % 360}).sortby(lon_name) # longitudes from 0 to 359
+        on_grid = [data[name].shape == target.shape and np.allclose(data[name].values,target)
+                   for name, target in [(lat_name,regrid_submission.TARGET_LATITUDES),(lon_name,regrid_submission.TARGET_LONGITUDES)]]
+        if not all(on_grid):
+            raise ValueError("Data is not on the 1 deg submission grid (latitudes 90 to -90, longitudes 0 to 359). Regrid it first with regrid_submission.regrid_to_submission_grid.")
+        data = data.values
+    data = np.asarray(data)
+    if data.ndim != 3 or data.shape[1:] != (181, 360):
+        raise ValueError(f"Data shape is {data.shape}, but expected (N, 181, 360).")
+    return data
+
+def ensemble_quintile_probabilities(ensemble,quintile_clim,member_weights=None,smoothing=0.0,lat_chunk=8):
+    ''' Computes the probability of each quintile category from an ensemble, for all members at once.
+
+    An ensemble member falls in category k (0 to 4) when it is bigger or equal to k of the four climatological quintile thresholds,
+    consistent with the categories used in forecast_evaluation. Without weights, exceedances of all members are counted at once a few latitude rows at a time;
+    with weights, they are accumulated in float32 one member at a time. Both bound memory use and avoid float64 copies of the comparisons.
+
+    Parameters:
+        ensemble (numpy.ndarray or xarray.DataArray): Ensemble forecast shaped (member, 181, 360).
+        quintile_clim (numpy.ndarray or xarray.DataArray): Climatological thresholds shaped (4, 181, 360), i.e. the output of retrieve_20yr_quintile_clim.
+        member_weights (array-like): Optional weight for each member. Weights are normalised to sum to one.
+        smoothing (float): Optional value between 0 and 1. Probabilities are blended with the climatological probability (0.2) using this weight.
+        lat_chunk (int): Number of latitude rows processed at a time when member_weights is None.
+
+    Returns:
+        numpy.ndarray: Probabilities shaped (5, 181, 360). Grid points with missing thresholds or no valid members are NaN.
+    '''
+    members = grid_values(ensemble)
+    thresholds = grid_values(quintile_clim)
+    if thresholds.shape[0] != 4:
+        raise ValueError(f"Expected 4 quintile thresholds, but got {thresholds.shape[0]}.")
+    if not 0.0 <= smoothing <= 1.0:
+        raise ValueError(f"Smoothing should be between 0 and 1, but got {smoothing}.")
+
+    num_members = members.shape[0]
+    if member_weights is not None:
+        weights = np.asarray(member_weights,dtype=np.float64)
+        if weights.shape != (num_members,) or np.any(weights < 0) or weights.sum() <= 0:
+            raise ValueError(f"member_weights should be {num_members} non-negative values with a positive sum.")
+        # counting is done in float32 whatever the precision of the ensemble, casting to float64 doubles the cost
+        weights = (weights/weights.sum()).astype(np.float32)
+
+    # thresholds are compared at the precision of the ensemble
+    thresholds = thresholds.astype(members.dtype,copy=False) if np.issubdtype(members.dtype,np.floating) else thresholds
+
+    # exceed[k] = weighted fraction of members >= threshold k, valid = weighted fraction of non-NaN members.
+    exceed = np.zeros((4,)+members.shape[1:])
+    valid = np.ones(members.shape[1:])
+    if member_weights is None:
+        # exact integer counts of all members at once, a few latitude rows at a time.
+        # summing the bytes of the boolean array is much cheaper than count_nonzero along an axis.
+        count_dtype = np.uint16 if num_members < 2**16 else np.uint32
+        for lat_start in range(0,members.shape[1],lat_chunk):
+            rows = slice(lat_start,lat_start+lat_chunk)
+            block = members[:,rows]
+            missing = np.isnan(block)
+            if missing.any():
+                valid[rows] = (~missing).view(np.uint8).sum(axis=0,dtype=count_dtype)/num_members
+            for k in range(4):
+                exceed[k,rows] = (block >= thresholds[k,rows]).view(np.uint8).sum(axis=0,dtype=count_dtype)/num_members
+    else:
+        # weighted counts accumulated one member at a time in float32, so the member field and thresholds stay in cache
+        # and no float64 copy of the comparisons is ever made.
+        exceed_32 = np.zeros((4,)+members.shape[1:],dtype=np.float32)
+        missing_32 = np.zeros(members.shape[1:],dtype=np.float32)
+        ge = np.empty(members.shape[1:],dtype=bool)
+        for member, weight in zip(members,weights):
+            missing = np.isnan(member)
+            if missing.any():
+                missing_32 += weight*missing
+            for k in range(4):
+                np.greater_equal(member,thresholds[k],out=ge)
+                exceed_32[k] += weight*ge
+        exceed[:] = exceed_32
+        valid = np.where(missing_32 > 0,1.0-missing_32,1.0)
+
+    # category probabilities from the difference between successive exceedance fractions
+    probs = np.empty((5,)+members.shape[1:])
+    probs[0] = valid-exceed[0]
+    probs[1:4] = exceed[:-1]-exceed[1:]
+    probs[4] = exceed[-1]
+    with np.errstate(invalid='ignore',divide='ignore'):
+        probs = probs/valid
+    probs[:,np.isnan(thresholds).any(axis=0) | (valid == 0)] = np.nan
+
+    if smoothing > 0.0:
+        probs = (1.0-smoothing)*probs+smoothing*0.2
+    return probs
+
+def AI_WQ_ensemble_to_submission(ensemble,quintile_clim,variable,fc_start_date,fc_period,teamname,modelname,member_weights=None,smoothing=0.0):
+    ''' Converts an ensemble forecast into a DataArray of quintile probabilities that is ready for AI_WQ_forecast_submission.
+
+    Parameters:
+        ensemble (numpy.ndarray or xarray.DataArray): Ensemble forecast shaped (member, 181, 360), with the same units as the climatology.
+        quintile_clim (numpy.ndarray or xarray.DataArray): Climatological thresholds shaped (4, 181, 360), i.e. the output of retrieve_20yr_quintile_clim.
+        variable (str): Saved variable. Options include 'tas', 'mslp' and 'pr'.
+        fc_start_date (str): The forecast start date as a string in format '%Y%m%d', i.e. 20241118.
+        fc_period (str or number): Either forecast period 1 (days 18 to 24) for forecast period 2 (days 25 to 31).
+        teamname (str): The teamname that was submitted during registration.
+        modelname (str): Modelname for particular forecast. Teams are only allowed to submit three models each.
+        member_weights (array-like): Optional weight for each member.
+        smoothing (float): Optional value between 0 and 1 used to blend probabilities with climatology.
+
+    Returns:
+        xarray.DataArray: Quintile probabilities in the AI Weather Quest submission format.
+    '''
+    # check before doing any work
+    check_fc_submission.check_filename_characteristics(variable,fc_start_date,fc_period,teamname,modelname)
+
+    probs = ensemble_quintile_probabilities(ensemble,quintile_clim,member_weights=member_weights,smoothing=smoothing)
+    return forecast_submission.AI_WQ_dataarray_from_buffer(probs,variable,fc_start_date,fc_period,teamname,modelname)
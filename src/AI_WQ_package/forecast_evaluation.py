@@ -1,4 +1,6 @@
 # python script that contains functions for working out RPSS score
+import xarray as xr
+import numpy as np
 
 def apply_land_sea_mask(score,land_sea_mask):
     # load in land sea mask
@@ -6,7 +8,7 @@ def apply_land_sea_mask(score,land_sea_mask):
     return score
 
 def conditional_function_quintiles(obs,quintiles):
-    num_quantiles=quintiles['quantile'].shape[0]
+    num_quintiles=quintiles['quantile'].shape[0]
 
     threshold_crit = []
 
@@ -25,17 +27,17 @@ def conditional_function_quintiles(obs,quintiles):
             threshold_crit.append(both_conds.all(dim='cond')) # both conditions must be true
 
     all_crit = xr.concat(threshold_crit,dim='category')
-    all_crit = all_crit.assign_coords({'category': ('category',np.arange(num_quantiles+1))})
+    all_crit = all_crit.assign_coords({'category': ('category',np.arange(num_quintiles+1))})
 
     return all_crit
 
 def work_obs_probs(obs,clim_quintiles):
-    obs_quant_thres = conditional_function_ERA5_quantiles(ERA5_fc_wk_avg,ERA5_hc_quantiles)
+    obs_quant_thres = conditional_function_quintiles(obs,clim_quintiles)
     # if within quantile range, set to 1.0.
-    obs_pbs = obs_quant_thres.where(True,1) # set the quantile threshold == 1 when threshold is met.
+    obs_pbs = obs_quant_thres.astype(float) # set the quantile threshold == 1 when threshold is met.
     return obs_pbs
 
-def work_out_RPSS(fc_pbs,obs_pbs,quantile_dim='category',num_quants=5,lsm=True):
+def work_out_RPSS(fc_pbs,obs_pbs,quantile_dim='category',num_quants=5,lsm=True,land_sea_mask=None):
     # cumulate across quantiles
     fc_pbs_cumsum = fc_pbs.cumsum(dim=quantile_dim)
     obs_pbs_cumsum = obs_pbs.cumsum(dim=quantile_dim)
@@ -48,15 +50,54 @@ def work_out_RPSS(fc_pbs,obs_pbs,quantile_dim='category',num_quants=5,lsm=True):
     RPS_score_clim = ((clim_pbs_cumsum-obs_pbs_cumsum)**2.0).sum(dim=quantile_dim)
 
     RPSS_wrt_clim = 1-(RPS_score_fc/RPS_score_clim)
-    if lsm == True:
+    # the land sea mask (e.g. from retrieve_land_sea_mask) is only applied when given
+    if lsm == True and land_sea_mask is not None:
         print ('applying land sea mask')
-        RPSS_wrt_clim = apply_land_sea_mask(RPSS_wrt_clim)
+        RPSS_wrt_clim = apply_land_sea_mask(RPSS_wrt_clim,land_sea_mask)
 
     return RPSS_wrt_clim
 
-def weighted_mean_calc(score,lat_bounds=[90,-90]):
-    import numpy as np
+def obs_quintile_category(obs,quintiles):
+    ''' Numpy equivalent of conditional_function_quintiles returning the category index rather than a boolean per category.
+
+    Parameters:
+        obs (numpy.ndarray): Observations shaped (..., lat, lon).
+        quintiles (numpy.ndarray): Quintile thresholds shaped (4, ..., lat, lon), broadcastable against obs.
+
+    Returns:
+        numpy.ndarray (uint8): Category from 0 (below first quintile) to 4 (above last quintile). 255 where obs or thresholds are NaN.
+    '''
+    category = np.zeros(np.broadcast_shapes(obs.shape,quintiles.shape[1:]),dtype=np.uint8)
+    for threshold in quintiles:
+        category += (obs >= threshold)
+    category[np.isnan(obs) | np.isnan(quintiles).any(axis=0)] = 255
+    return category
+
+def RPS_from_category(fc_pbs,obs_category,num_quants=5):
+    ''' Numpy RPS of forecast probabilities and of climatology given the observed category from obs_quintile_category.
 
+    Parameters:
+        fc_pbs (numpy.ndarray): Forecast probabilities shaped (..., num_quants, lat, lon).
+        obs_category (numpy.ndarray): Observed category shaped (..., lat, lon).
+
+    Returns:
+        tuple of numpy.ndarray: RPS of the forecast and RPS of climatological probabilities (1/num_quants), both NaN where obs_category is 255.
+    '''
+    RPS_score_fc = np.zeros(obs_category.shape)
+    RPS_score_clim = np.zeros(obs_category.shape)
+    fc_pbs_cumsum = np.zeros(obs_category.shape)
+    # the last cumulative category is always 1.0 for both forecast and observations so it is left out
+    for q in range(num_quants-1):
+        fc_pbs_cumsum = fc_pbs_cumsum+fc_pbs[...,q,:,:]
+        obs_pbs_cumsum = (obs_category <= q)
+        RPS_score_fc += (fc_pbs_cumsum-obs_pbs_cumsum)**2.0
+        RPS_score_clim += ((q+1.0)/num_quants-obs_pbs_cumsum)**2.0
+    missing = (obs_category == 255)
+    RPS_score_fc[missing] = np.nan
+    RPS_score_clim[missing] = np.nan
+    return RPS_score_fc, RPS_score_clim
+
+def weighted_mean_calc(score,lat_bounds=[90,-90]):
     if lat_bounds[0] < lat_bounds[1]:
         lat_bounds = [lat_bounds[1],lat_bounds[0]] # always put highest latitude first
     # extract selected lat region
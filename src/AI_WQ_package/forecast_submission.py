@@ -3,9 +3,13 @@ import xarray as xr
 import numpy as np
 import ftplib
 import os
+import functools
+import tempfile
 #import sys
 #sys.path.append('/perm/ecm0847/S2S_comp/AI_WEATHER_QUEST_code/AI_weather_quest/src/AI_WQ_package/')
 from AI_WQ_package import check_fc_submission
+from AI_WQ_package import ftp_connection
+from AI_WQ_package import regrid_submission
 
 def create_ftp_dir_if_does_not_exist(ftp,dir_name):
     """
@@ -28,14 +32,12 @@ def create_ftp_dir_if_does_not_exist(ftp,dir_name):
             # Raise if the error is something else (not directory not found)
             raise
 
-def AI_WQ_create_empty_dataarray(variable,fc_start_date,fc_period,teamname,modelname):
-    ''' A function that creates an 'empty' dataarray that supports forecast submission for the AI Weather Quest. 
-    The AI WQ advises that users use this function to output an empty dataarray and then fill it with their forecasted values. The function is also used during forecast submission to the FTP site to ensure all participants submit the same file structure.
+@functools.lru_cache(maxsize=None)
+def _submission_template(variable,fc_period):
+    ''' Builds the parts of the submission DataArray that only depend on (variable, fc_period).
+    The result is cached so that coordinates and attributes are created once per (variable, period) rather than for every submission.
+    Coordinate arrays are set read-only as they are shared between all DataArrays built from the template.
     '''
-
-    # Check filename characteristics and output a string version of fc_period
-    fc_period = check_fc_submission.check_filename_characteristics(variable,fc_start_date,fc_period,teamname,modelname)
-
     # standard for all variables
     standard_names_all_vars = {'units':'1','coordinates':'latitude longitude'}
 
@@ -59,8 +61,7 @@ def AI_WQ_create_empty_dataarray(variable,fc_start_date,fc_period,teamname,model
                         }
     else:
         height = None  # No height for other variables
-
-    fc_issue_date = fc_start_date[:4]+'-'+fc_start_date[4:6]+'-'+fc_start_date[6:]
+        height_attrs = None
 
     # alongside defining the forecast issue date, define the forecasting period in days from forecasting issue date.
     if fc_period == '1':
@@ -75,30 +76,44 @@ def AI_WQ_create_empty_dataarray(variable,fc_start_date,fc_period,teamname,model
             forecast_period_end = 31.75
         elif variable == 'pr':
             forecast_period_end = 32.0
-    forecast_period_bounds = [[forecast_period_start,forecast_period_end]]
-
-    # empty data
-    empty_data = np.empty((5,181,360))
 
     # dimension attributes
     lat_attrs = {'units':'degrees_north','long_name':'latitude','standard_name':'latitude','axis':'X'}
     lon_attrs = {'units':'degrees_east','long_name':'longitude','standard_name':'longitude','axis':'Y'}
+    quintile = np.arange(0.2,1.1,0.2) # outputs [0.2,0.4,0.6,0.8,1.0]
     latitude = np.arange(90.0,-91.0,-1.0)
     longitude = np.arange(0.0,360.0,1.0)
+    for coord_vals in (quintile,latitude,longitude):
+        coord_vals.flags.writeable = False
+
+    return dict(data_specs=data_specs,height=height,height_attrs=height_attrs,
+                forecast_period_start=forecast_period_start,forecast_period_end=forecast_period_end,
+                quintile=quintile,latitude=latitude,latitude_attrs=lat_attrs,longitude=longitude,longitude_attrs=lon_attrs)
+
+def _build_submission_dataarray(data,variable,fc_start_date,fc_period,teamname,modelname):
+    ''' Wraps a (5, 181, 360) numpy array in the submission DataArray structure. The array is used as is (no copy is made).
+    fc_period should already have been converted to a string by check_filename_characteristics.
+    '''
+    template = _submission_template(variable,fc_period)
+    forecast_period_start = template['forecast_period_start']
+    forecast_period_end = template['forecast_period_end']
+    height = template['height']
+
+    fc_issue_date = fc_start_date[:4]+'-'+fc_start_date[4:6]+'-'+fc_start_date[6:]
 
     # work out forecast issue time
     fc_issue_time = np.datetime64(fc_issue_date+'T00:00:00')
     # With the data, make a dataset array. Streamlining dataset creation so all submissions are the same.
-    da = xr.DataArray(data=empty_data,dims=['quintile','latitude','longitude'],
-            coords=dict(quintile=(['quintile'],np.arange(0.2,1.1,0.2)), # outputs [0.2,0.4,0.6,0.8,1.0]
-                        latitude=(['latitude'],latitude,lat_attrs),
-                        longitude=(['longitude'],longitude,lon_attrs),
+    da = xr.DataArray(data=data,dims=['quintile','latitude','longitude'],
+            coords=dict(quintile=(['quintile'],template['quintile']),
+                        latitude=(['latitude'],template['latitude'],template['latitude_attrs']),
+                        longitude=(['longitude'],template['longitude'],template['longitude_attrs']),
                         forecast_issue_date=fc_issue_time,
                         forecast_period_start=fc_issue_time+np.timedelta64(int(forecast_period_start*24), 'h'),
                         forecast_period_end=fc_issue_time+np.timedelta64(int(forecast_period_end*24), 'h'),
                         height=height if height is not None else None
                         ),
-            attrs=dict(**data_specs,description=variable+' prediction from '+teamname+' using '+modelname+' for forecasting period '+str(fc_period),
+            attrs=dict(**template['data_specs'],description=variable+' prediction from '+teamname+' using '+modelname+' for forecasting period '+str(fc_period),
                 Conventions='CF-1.6',
                 forecast_period_bounds_units='days into forecast',
                 forecast_period_bounds=f"[{forecast_period_start},{forecast_period_end}]"))
@@ -108,11 +123,73 @@ def AI_WQ_create_empty_dataarray(variable,fc_start_date,fc_period,teamname,model
     da.coords['forecast_period_end'].attrs = {'long_name': 'forecast period end','axis':'T'}
 
     if height is not None:
-        da.coords['height'].attrs = height_attrs
+        da.coords['height'].attrs = dict(template['height_attrs'])
 
     return da
 
-def AI_WQ_forecast_submission(data,password,variable,fc_start_date,fc_period,teamname,modelname):
+def AI_WQ_create_empty_dataarray(variable,fc_start_date,fc_period,teamname,modelname):
+    ''' A function that creates an 'empty' dataarray that supports forecast submission for the AI Weather Quest. 
+    The AI WQ advises that users use this function to output an empty dataarray and then fill it with their forecasted values. The function is also used during forecast submission to the FTP site to ensure all participants submit the same file structure.
+    '''
+
+    # Check filename characteristics and output a string version of fc_period
+    fc_period = check_fc_submission.check_filename_characteristics(variable,fc_start_date,fc_period,teamname,modelname)
+
+    # empty data
+    empty_data = np.empty((5,181,360))
+
+    return _build_submission_dataarray(empty_data,variable,fc_start_date,fc_period,teamname,modelname)
+
+def AI_WQ_dataarray_from_buffer(buffer,variable,fc_start_date,fc_period,teamname,modelname,lat_ascending=False):
+    ''' A function that wraps an existing numpy buffer (e.g. model inference output or a shared-memory array) in the AI Weather Quest submission DataArray without copying it.
+
+    Parameters:
+        buffer (array-like): Forecasted probabilities shaped (quintile, lat, long), i.e. (5, 181, 360). Anything supporting the buffer protocol is accepted.
+        variable (str): Saved variable. Options include 'tas', 'mslp' and 'pr'.
+        fc_start_date (str): The forecast start date as a string in format '%Y%m%d', i.e. 20241118.
+        fc_period (str or number): Either forecast period 1 (days 18 to 24) for forecast period 2 (days 25 to 31).
+        teamname (str): The teamname that was submitted during registration.
+        modelname (str): Modelname for particular forecast. Teams are only allowed to submit three models each.
+        lat_ascending (bool): Set to True if the buffer latitudes run from -90 to 90. The latitudes are then flipped as a view, not a copy.
+
+    Returns:
+        xarray.DataArray: DataArray sharing memory with buffer. Changes to buffer are seen by the DataArray.
+    '''
+    # Check filename characteristics and output a string version of fc_period
+    fc_period = check_fc_submission.check_filename_characteristics(variable,fc_start_date,fc_period,teamname,modelname)
+
+    data = np.asarray(buffer) # does not copy if buffer is already an ndarray or exposes the buffer protocol
+    expected_shape = (5, 181, 360)
+    if data.shape != expected_shape:
+        raise ValueError(f"Buffer shape is {data.shape}, but expected {expected_shape}.")
+
+    if lat_ascending:
+        data = data[:,::-1,:] # reversed view of the latitude axis, 90 to -90
+
+    return _build_submission_dataarray(data,variable,fc_start_date,fc_period,teamname,modelname)
+
+def upload_submission_file(session,final_filename,fc_start_date):
+    ''' Transfers a saved forecast file to the forecast_submissions folder of the FTP site, replacing any existing file of the same name.
+
+    Parameters:
+        session (ftplib.FTP): An open FTP session. The session is left open so it can be reused.
+        final_filename (str): Local file, named as output by check_fc_submission.all_checks.
+        fc_start_date (str): The forecast start date as a string in format '%Y%m%d', i.e. 20241118.
+    '''
+    create_ftp_dir_if_does_not_exist(session,'/forecast_submissions/'+fc_start_date) # save the forecast directory if it does not exist
+    remote_path = f"/forecast_submissions/{fc_start_date}/{os.path.basename(final_filename)}"
+    print (remote_path)
+
+    # as of 6th Dec 2024 - couldn't rewrite over old files so delete if already existing
+    try:
+        session.delete(remote_path)
+        print(f"Existing file '{final_filename}' deleted.")
+    except ftplib.error_perm:
+        pass
+    with open(final_filename,'rb') as file: # read the forecast file
+        session.storbinary(f'STOR {remote_path}',file) # transfer to FTP site
+
+def AI_WQ_forecast_submission(data,password,variable,fc_start_date,fc_period,teamname,modelname,regrid_method=None,regrid_cache_dir=None,session=None):
     ''' This function will take a dataset in quintile, lat, long format, save as appropriate netCDF format,
     then copy to FTP site under correct forecast folder, i.e. 20241118. 
 
@@ -123,41 +200,40 @@ def AI_WQ_forecast_submission(data,password,variable,fc_start_date,fc_period,tea
         fc_period (str or number): Either forecast period 1 (days 18 to 24) for forecast period 2 (days 25 to 31).
         teamname (str): The teamname that was submitted during registration.
         modelname (str): Modelname for particular forecast. Teams are only allowed to submit three models each.
+        regrid_method (str): Optional. If 'conservative' or 'bilinear', data on any global latitude-longitude grid is first regridded to the 1 deg submission grid.
+        regrid_cache_dir (str): Optional directory where regridding weights are saved so they are only computed once per source grid.
+        session (ftplib.FTP): Optional open FTP session to upload with. If not given, a new session is opened and closed for this submission.
 
     '''
     ###############################################################################################################
     # CHECKING DATA FORMAT AND INPUTTED VARIABLES
+    # regrid to the 1 deg submission grid if requested
+    if regrid_method is not None:
+        data = regrid_submission.regrid_to_submission_grid(data,method=regrid_method,cache_dir=regrid_cache_dir)
+
     # outputs the data (dataarray) and final filename
     data, final_filename = check_fc_submission.all_checks(data,variable,fc_start_date,fc_period,teamname,modelname)
 
     data_only = data.values # this should be shaped, quintile, latitude, longitude. check has been made in all_checks
 
-    submitted_da = AI_WQ_create_empty_dataarray(variable,fc_start_date,fc_period,teamname,modelname) # create an empty dataarray.
-    submitted_da.values = data_only
+    submitted_da = AI_WQ_dataarray_from_buffer(data_only,variable,fc_start_date,fc_period,teamname,modelname) # wrap the checked values, no copy.
 
-    submitted_da.to_netcdf(final_filename) # save netcdf file temporaily whether the script is being run
-    
     ################################################################################################################
     
-    # save new dataset as netCDF to FTP site
-    session = ftplib.FTP('ftp.ecmwf.int','ai_weather_quest',password) # open FTP session
-    create_ftp_dir_if_does_not_exist(session,'forecast_submissions/'+fc_start_date) # save the forecast directory if it does not exist
-    remote_path = f"/forecast_submissions/{fc_start_date}/{final_filename}"
-    print (remote_path)
-
-    file = open(final_filename,'rb') # read the forecast file
-    
-    # as of 6th Dec 2024 - couldn't rewrite over old files so delete if already existing
+    # save new dataset as netCDF to FTP site.
+    # the file is saved temporarily in its own directory, so a file of the same name in the working directory (e.g. a directory watched by submission_service) is never overwritten or deleted
+    if session is None:
+        ftp_session = ftp_connection.open_ftp_session(password) # open FTP session
+    else:
+        ftp_session = session # reuse an already open session (e.g. from submission_service)
     try:
-        session.delete(remote_path)
-        print(f"Existing file '{final_filename}' deleted.")
-    except ftplib.error_perm:
-        pass
-    session.storbinary(f'STOR {remote_path}',file) # transfer to FTP site
-    file.close() # close the file and quit the session
-    session.quit()
-
-    os.remove(final_filename) # delete the saved dataarray.
+        with tempfile.TemporaryDirectory() as temp_dir: # deleted with the saved dataarray once uploaded
+            local_filename = os.path.join(temp_dir,final_filename)
+            submitted_da.to_netcdf(local_filename)
+            upload_submission_file(ftp_session,local_filename,fc_start_date)
+    finally:
+        if session is None:
+            ftp_session.quit()
     
     return submitted_da
 
@@ -0,0 +1,35 @@
+# script that holds the FTP server details used by every transfer in the package.
+import ftplib
+import os
+
+# The server can be changed with set_ftp_server or the AI_WQ_FTP_HOST and AI_WQ_FTP_PORT environment variables,
+# e.g. to point the package at local_ftp_server for offline testing.
+FTP_SERVER = {'host':os.environ.get('AI_WQ_FTP_HOST','ftp.ecmwf.int'),
+              'port':int(os.environ.get('AI_WQ_FTP_PORT','21')),
+              'user':'ai_weather_quest',
+              'timeout':None}
+
+def set_ftp_server(host='ftp.ecmwf.int',port=21,user='ai_weather_quest',timeout=None):
+    ''' Sets the FTP server used by all functions that transfer files. Calling without arguments restores the ECMWF server.
+
+    Parameters:
+        host (str): Server hostname.
+        port (int): Server port.
+        user (str): Username to log in with.
+        timeout (float): Optional timeout in seconds for blocking socket operations, so dropped connections raise an error instead of hanging.
+    '''
+    FTP_SERVER.update(host=host,port=int(port),user=user,timeout=timeout)
+
+def open_ftp_session(password):
+    ''' Opens and logs onto an FTP session with the configured server.
+
+    Returns:
+        ftplib.FTP: The logged in FTP session.
+    '''
+    if FTP_SERVER['timeout'] is None:
+        session = ftplib.FTP()
+    else:
+        session = ftplib.FTP(timeout=FTP_SERVER['timeout'])
+    session.connect(FTP_SERVER['host'],FTP_SERVER['port'])
+    session.login(FTP_SERVER['user'],password)
+    return session
@@ -0,0 +1,201 @@
+# script that scores hindcasts against every week of the training record with bounded memory, using all cores.
+import xarray as xr
+import numpy as np
+import os
+import glob
+from concurrent.futures import ProcessPoolExecutor
+from AI_WQ_package import check_fc_submission
+from AI_WQ_package import forecast_evaluation
+
+# regions used for the aggregated scores, given as latitude bounds (highest latitude first) as in weighted_mean_calc.
+DEFAULT_REGIONS = {'global':[90,-90],'northern_extratropics':[90,30],'tropics':[30,-30],'southern_extratropics':[-30,-90]}
+
+def as_file_list(files):
+    ''' Accepts a single path, a glob pattern or a list of paths and returns a sorted list of paths.
+    '''
+    if isinstance(files,str):
+        matched = sorted(glob.glob(files))
+        if not matched:
+            raise ValueError(f"No files found matching '{files}'.")
+        return matched
+    return list(files)
+
+def open_field(path):
+    ''' Lazily opens a file as a DataArray with 'latitude' and 'longitude' coordinates (latitudes from 90 to -90).
+    Only the file metadata is read, values are loaded when indexed.
+    '''
+    data = xr.open_dataset(path)
+    if 'time_bnds' in data:
+        data = data.drop_vars('time_bnds')
+    data = data[list(data.data_vars)[0]] # training data, climatology and hindcast files hold a single variable
+    data = data.rename({name: new_name for name, new_name in [('lat','latitude'),('lon','longitude')] if name in data.dims})
+    return check_fc_submission.lat_descending(data)
+
+def build_time_index(files):
+    ''' Maps every time in a set of files to (file, index in file). Only the time coordinates are read.
+    '''
+    time_index = {}
+    for path in files:
+        with xr.open_dataset(path) as ds:
+            for i, time in enumerate(ds['time'].values):
+                time_index[np.datetime64(time,'ns')] = (path,i)
+    return time_index
+
+def load_times(times,time_index):
+    ''' Loads the values at the requested times, opening each file once.
+    '''
+    values = []
+    open_files = {}
+    for time in times:
+        path, i = time_index[time]
+        if path not in open_files:
+            open_files[path] = open_field(path)
+        values.append(open_files[path].isel(time=i).values)
+    for field in open_files.values():
+        field.close()
+    return np.stack(values)
+
+def region_masks(regions,land_sea_mask=None):
+    ''' Returns cos(latitude) weights for each region shaped (region, 181, 360). Zero outside the region (and over the sea if land_sea_mask is given).
+    A land_sea_mask DataArray (e.g. from retrieve_land_sea_mask) is put on the submission grid ordering first, as in observed_category_archive.save_land_sea_mask_bits.
+    '''
+    if isinstance(land_sea_mask,xr.DataArray):
+        land_sea_mask = check_fc_submission.lat_descending(land_sea_mask).transpose('latitude','longitude').values
+    if land_sea_mask is not None:
+        land_sea_mask = np.asarray(land_sea_mask)
+        if land_sea_mask.shape != (181,360):
+            raise ValueError(f"Land sea mask shape is {land_sea_mask.shape}, but expected (181, 360).")
+    latitude = np.arange(90.0,-91.0,-1.0)
+    cos_lat = np.broadcast_to(np.cos(np.deg2rad(latitude))[:,None],(181,360))
+    weights = []
+    for lat_bounds in regions.values():
+        north, south = max(lat_bounds), min(lat_bounds)
+        region_weight = np.where(((latitude <= north) & (latitude >= south))[:,None],cos_lat,0.0)
+        if land_sea_mask is not None:
+            region_weight = np.where(land_sea_mask >= 0.8,region_weight,0.0) # same threshold as apply_land_sea_mask
+        weights.append(region_weight)
+    return np.stack(weights)
+
+def score_chunk(times,fc_index,obs_index,clim_index,region_weights,results_file):
+    ''' Scores a chunk of weeks and writes the result to results_file. Runs in a worker process.
+    '''
+    fc_pbs = load_times(times,fc_index)
+    obs = load_times(times,obs_index)
+    quintiles = load_times(times,clim_index)
+    # obs_quintile_category expects the quantile axis first
+    obs_category = forecast_evaluation.obs_quintile_category(obs,np.moveaxis(quintiles,1,0))
+    RPS_fc, RPS_clim = forecast_evaluation.RPS_from_category(fc_pbs,obs_category)
+
+    valid = ~np.isnan(RPS_fc)
+    RPS_fc = np.where(valid,RPS_fc,0.0)
+    RPS_clim = np.where(valid,RPS_clim,0.0)
+    # area-weighted regional sums for each week, (week, region)
+    RPS_fc_region = np.einsum('tyx,ryx->tr',RPS_fc,region_weights)
+    RPS_clim_region = np.einsum('tyx,ryx->tr',RPS_clim,region_weights)
+
+    # the partial file name does not match the 'chunk_*.npz' pattern read by the summary
+    partial_filename = os.path.join(os.path.dirname(results_file),'.part_'+os.path.basename(results_file))
+    np.savez(partial_filename,times=np.asarray(times,dtype='datetime64[ns]'),
+             RPS_fc_region=RPS_fc_region,RPS_clim_region=RPS_clim_region,
+             RPS_fc_sum=RPS_fc.sum(axis=0),RPS_clim_sum=RPS_clim.sum(axis=0),count=valid.sum(axis=0))
+    os.replace(partial_filename,results_file) # only complete chunks end up in the results directory
+    return results_file
+
+def scored_times(results_dir):
+    ''' Returns the set of weeks already scored in results_dir.
+    '''
+    times = set()
+    for path in glob.glob(os.path.join(results_dir,'chunk_*.npz')):
+        with np.load(path) as chunk:
+            times.update(np.datetime64(time,'ns') for time in chunk['times'])
+    return times
+
+def run_hindcast_verification(hindcast_files,obs_files,clim_files,results_dir,land_sea_mask=None,regions=DEFAULT_REGIONS,chunk_weeks=8,num_workers=None):
+    ''' Scores hindcast probabilities against observations for every week they have in common, writing results to results_dir.
+
+    Forecasts, observations and climatology are matched on their 'time' coordinate, so all three should use the same time label for a verifying week.
+    Each worker process only holds chunk_weeks weeks of data in memory. Weeks that have already been scored are skipped, so an interrupted run can be resumed,
+    or the record extended, by calling the function again (also with a different chunk_weeks).
+
+    Parameters:
+        hindcast_files (str or list): Path, glob pattern or list of netCDF files with probabilities shaped (time, quintile, latitude, longitude) on the 1 deg submission grid.
+        obs_files (str or list): Weekly observations shaped (time, latitude, longitude), e.g. files from retrieve_annual_training_data.
+        clim_files (str or list): Quintile thresholds shaped (time, quantile, latitude, longitude), e.g. saved output of complete_20yr_quintiles.
+        results_dir (str): Directory where scored chunks and the summary are written.
+        land_sea_mask (numpy.ndarray or xarray.DataArray): Optional mask on the 1 deg grid, e.g. from retrieve_land_sea_mask. Arrays should be (181, 360) with latitudes from 90 to -90, DataArrays can have either latitude order or dimension order. Only grid points with a value >= 0.8 are scored.
+        regions (dict): Region name to latitude bounds.
+        chunk_weeks (int): Number of weeks scored at a time by each worker.
+        num_workers (int): Number of worker processes. Defaults to the number of cores.
+
+    Returns:
+        xarray.Dataset: Summary from summarise_hindcast_verification.
+    '''
+    fc_index = build_time_index(as_file_list(hindcast_files))
+    obs_index = build_time_index(as_file_list(obs_files))
+    clim_index = build_time_index(as_file_list(clim_files))
+
+    times = sorted(set(fc_index) & set(obs_index) & set(clim_index))
+    if not times:
+        raise ValueError("No common times found between hindcast, observation and climatology files.")
+    print(f"Scoring {len(times)} weeks from {str(times[0])[:10]} to {str(times[-1])[:10]}.")
+
+    region_weights = region_masks(regions,land_sea_mask)
+
+    os.makedirs(results_dir,exist_ok=True)
+    already_scored = scored_times(results_dir)
+    times_to_score = [time for time in times if time not in already_scored] # scored during a previous run
+    print(f"{len(times)-len(times_to_score)} weeks already scored.")
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = []
+        for start in range(0,len(times_to_score),chunk_weeks):
+            chunk_times = times_to_score[start:start+chunk_weeks]
+            results_file = os.path.join(results_dir,f"chunk_{str(chunk_times[0])[:10]}_{str(chunk_times[-1])[:10]}.npz")
+            futures.append(executor.submit(score_chunk,chunk_times,
+                                           {t: fc_index[t] for t in chunk_times},{t: obs_index[t] for t in chunk_times},{t: clim_index[t] for t in chunk_times},
+                                           region_weights,results_file))
+        for future in futures:
+            print(f"Scored '{future.result()}'.")
+
+    return summarise_hindcast_verification(results_dir,regions)
+
+def summarise_hindcast_verification(results_dir,regions=DEFAULT_REGIONS):
+    ''' Combines the scored chunks in results_dir into per-week and aggregated regional RPSS, saved to results_dir/summary.nc.
+    Regional RPSS is 1 - (area-weighted mean RPS of forecast) / (area-weighted mean RPS of climatology).
+
+    Returns:
+        xarray.Dataset: RPSS_weekly (time, region), RPSS (region) over all weeks and RPSS_map (latitude, longitude) over all weeks.
+    '''
+    chunk_files = sorted(glob.glob(os.path.join(results_dir,'chunk_*.npz')))
+    if not chunk_files:
+        raise ValueError(f"No scored chunks found in '{results_dir}'.")
+    chunks, seen_times = [], set()
+    for path in chunk_files:
+        chunk = dict(np.load(path))
+        chunk_times = set(chunk['times'].astype('datetime64[ns]'))
+        overlap = chunk_times & seen_times
+        if overlap == chunk_times:
+            continue # every week already counted, e.g. a chunk left over from a run with a different chunk_weeks
+        if overlap:
+            raise ValueError(f"'{path}' partly overlaps other scored chunks, so its weeks would be counted twice. Remove it and rerun run_hindcast_verification.")
+        seen_times |= chunk_times
+        chunks.append(chunk)
+    times = np.concatenate([chunk['times'] for chunk in chunks])
+    RPS_fc_region = np.concatenate([chunk['RPS_fc_region'] for chunk in chunks])
+    RPS_clim_region = np.concatenate([chunk['RPS_clim_region'] for chunk in chunks])
+    order = np.argsort(times) # chunks from resumed runs are not necessarily in date order
+    times, RPS_fc_region, RPS_clim_region = times[order], RPS_fc_region[order], RPS_clim_region[order]
+    RPS_fc_sum = sum(chunk['RPS_fc_sum'] for chunk in chunks)
+    RPS_clim_sum = sum(chunk['RPS_clim_sum'] for chunk in chunks)
+
+    with np.errstate(invalid='ignore',divide='ignore'):
+        RPSS_weekly = 1-RPS_fc_region/RPS_clim_region
+        RPSS_total = 1-RPS_fc_region.sum(axis=0)/RPS_clim_region.sum(axis=0)
+        RPSS_map = np.where(RPS_clim_sum > 0,1-RPS_fc_sum/RPS_clim_sum,np.nan)
+
+    summary = xr.Dataset(data_vars=dict(RPSS_weekly=(['time','region'],RPSS_weekly),
+                                        RPSS=(['region'],RPSS_total),
+                                        RPSS_map=(['latitude','longitude'],RPSS_map)),
+                         coords=dict(time=times,region=list(regions),
+                                     latitude=np.arange(90.0,-91.0,-1.0),longitude=np.arange(0.0,360.0,1.0)))
+    summary.to_netcdf(os.path.join(results_dir,'summary.nc'))
+    return summary
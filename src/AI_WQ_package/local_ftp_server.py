@@ -0,0 +1,349 @@
+# a local stand-in for the AI Weather Quest FTP site, with injected latency, bandwidth caps, dropped connections and 550 errors.
+# Used to test and benchmark the transfer functions offline, e.g.
+#
+#   with local_ftp_server.LocalFTPServer('ftp_root',latency=0.05,bandwidth=1e6,drop_rate=0.1) as server:
+#       ftp_connection.set_ftp_server('127.0.0.1',server.port,timeout=10)
+#       retrieve_evaluation_data.retrieve_weekly_obs('20241230','tas','any_password')
+#       print(server.stats)
+#   ftp_connection.set_ftp_server()
+import os
+import posixpath
+import random
+import socket
+import socketserver
+import threading
+import time
+import fnmatch
+
+# top level folders of the AI Weather Quest FTP site
+REMOTE_LAYOUT = ['climatologies','observations','training_data','forecast_submissions']
+
+def create_remote_layout(root):
+    ''' Creates the top level folders of the FTP site in root. Files should then be copied to the same paths as on the FTP site,
+    e.g. root/climatologies/{year}/..., root/observations/{date}/..., root/training_data/... and root/land_sea_mask_1DEG.nc.
+    '''
+    for folder in REMOTE_LAYOUT:
+        os.makedirs(os.path.join(root,folder),exist_ok=True)
+
+class InjectedDrop(Exception):
+    ''' Raised inside the server to close a connection on purpose.
+    '''
+
+class FTPHandler(socketserver.StreamRequestHandler):
+    ''' Handles one client connection. Implements the subset of FTP used by ftplib for login, directory creation, deletion, listing and binary transfers.
+    '''
+    def setup(self):
+        super().setup()
+        self.cwd = '/'
+        self.pasv_socket = None
+        self.server.count('connections')
+
+    def reply(self,line):
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+        self.wfile.write((line+'\r\n').encode())
+        self.wfile.flush()
+
+    def local_path(self,path):
+        ''' Maps a remote path to a path inside the server root. Paths cannot escape the root.
+        '''
+        remote = posixpath.normpath(posixpath.join(self.cwd,path or '.'))
+        if not remote.startswith('/'):
+            remote = '/'+remote
+        return remote, os.path.join(self.server.root,*[part for part in remote.split('/') if part])
+
+    def handle(self):
+        self.reply('220 AI Weather Quest local FTP stand-in ready.')
+        try:
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    break
+                command, _, arg = line.decode().strip().partition(' ')
+                command = command.upper()
+                self.server.count('commands')
+                method = getattr(self,'ftp_'+command,None)
+                if method is None:
+                    self.reply(f'502 Command {command} not implemented.')
+                    continue
+                if method(arg) == 'quit':
+                    break
+        except (InjectedDrop,ConnectionError):
+            pass
+        finally:
+            self.close_pasv()
+
+    def injected_550(self,remote):
+        ''' Returns True (and replies 550) if a 550 error should be injected for this path.
+        '''
+        if self.server.should_fail(remote):
+            self.server.count('injected_550')
+            self.reply(f'550 {remote}: injected failure.')
+            return True
+        return False
+
+    def close_pasv(self):
+        if self.pasv_socket is not None:
+            self.pasv_socket.close()
+            self.pasv_socket = None
+
+    def open_data_connection(self):
+        if self.pasv_socket is None:
+            self.reply('425 Use PASV or EPSV first.')
+            return None
+        self.pasv_socket.settimeout(10)
+        try:
+            conn, _ = self.pasv_socket.accept()
+        except socket.timeout:
+            self.reply('425 Data connection not opened.')
+            return None
+        finally:
+            self.close_pasv()
+        return conn
+
+    def maybe_drop(self):
+        if self.server.should_drop():
+            self.server.count('dropped')
+            raise InjectedDrop()
+
+    # commands
+    def ftp_USER(self,arg):
+        self.reply('331 Password required.')
+
+    def ftp_PASS(self,arg):
+        if self.server.password is not None and arg != self.server.password:
+            self.reply('530 Login incorrect.')
+        else:
+            self.reply('230 Logged in.')
+
+    def ftp_SYST(self,arg):
+        self.reply('215 UNIX Type: L8')
+
+    def ftp_TYPE(self,arg):
+        self.reply(f'200 Type set to {arg}.')
+
+    def ftp_NOOP(self,arg):
+        self.reply('200 NOOP ok.')
+
+    def ftp_QUIT(self,arg):
+        self.reply('221 Goodbye.')
+        return 'quit'
+
+    def ftp_PWD(self,arg):
+        self.reply(f'257 "{self.cwd}" is the current directory.')
+
+    def ftp_CWD(self,arg):
+        remote, path = self.local_path(arg)
+        if self.injected_550(remote):
+            return
+        if os.path.isdir(path):
+            self.cwd = remote
+            self.reply(f'250 Directory changed to {remote}.')
+        else:
+            self.reply(f'550 {remote}: No such file or directory.')
+
+    def ftp_MKD(self,arg):
+        remote, path = self.local_path(arg)
+        if self.injected_550(remote):
+            return
+        try:
+            os.mkdir(path)
+        except OSError:
+            self.reply(f'550 {remote}: Cannot create directory.')
+            return
+        self.reply(f'257 "{remote}" created.')
+
+    def ftp_DELE(self,arg):
+        remote, path = self.local_path(arg)
+        if self.injected_550(remote):
+            return
+        if not os.path.isfile(path):
+            self.reply(f'550 {remote}: No such file.')
+            return
+        os.remove(path)
+        self.reply(f'250 {remote} deleted.')
+
+    def ftp_SIZE(self,arg):
+        remote, path = self.local_path(arg)
+        if self.injected_550(remote):
+            return
+        if not os.path.isfile(path):
+            self.reply(f'550 {remote}: No such file.')
+            return
+        self.reply(f'213 {os.path.getsize(path)}')
+
+    def ftp_PASV(self,arg):
+        self.close_pasv()
+        self.pasv_socket = socket.create_server((self.server.server_address[0],0))
+        host, port = self.pasv_socket.getsockname()[:2]
+        self.reply(f"227 Entering Passive Mode ({host.replace('.',',')},{port>>8},{port&0xFF}).")
+
+    def ftp_EPSV(self,arg):
+        self.close_pasv()
+        self.pasv_socket = socket.create_server((self.server.server_address[0],0))
+        self.reply(f'229 Entering Extended Passive Mode (|||{self.pasv_socket.getsockname()[1]}|).')
+
+    def ftp_NLST(self,arg):
+        remote, path = self.local_path(arg)
+        if self.injected_550(remote):
+            self.close_pasv()
+            return
+        if not os.path.exists(path):
+            self.reply(f'550 {remote}: No such file or directory.')
+            self.close_pasv()
+            return
+        names = sorted(os.listdir(path)) if os.path.isdir(path) else [posixpath.basename(remote)]
+        self.send_data(('\r\n'.join(names)+'\r\n').encode() if names else b'')
+
+    ftp_LIST = ftp_NLST
+
+    def ftp_RETR(self,arg):
+        remote, path = self.local_path(arg)
+        if self.injected_550(remote):
+            self.close_pasv()
+            return
+        if not os.path.isfile(path):
+            self.reply(f'550 {remote}: No such file.')
+            self.close_pasv()
+            return
+        with open(path,'rb') as f:
+            self.send_data(f.read())
+
+    def ftp_STOR(self,arg):
+        remote, path = self.local_path(arg)
+        if self.injected_550(remote):
+            self.close_pasv()
+            return
+        if not os.path.isdir(os.path.dirname(path)):
+            self.reply(f'553 {remote}: Directory does not exist.')
+            self.close_pasv()
+            return
+        self.reply('150 Ready to receive data.')
+        conn = self.open_data_connection()
+        if conn is None:
+            return
+        partial_path = path+'.part'
+        with conn, open(partial_path,'wb') as f:
+            while True:
+                block = conn.recv(65536)
+                if not block:
+                    break
+                self.server.throttle(len(block))
+                self.server.count('bytes_received',len(block))
+                f.write(block)
+        try:
+            self.maybe_drop() # dropped before the transfer is confirmed, the file is not stored
+        except InjectedDrop:
+            os.remove(partial_path)
+            raise
+        os.replace(partial_path,path)
+        self.reply('226 Transfer complete.')
+
+    def send_data(self,data):
+        ''' Sends data over the data connection, throttled to the bandwidth cap. Dropped connections are cut half way through.
+        '''
+        self.reply('150 Opening data connection.')
+        conn = self.open_data_connection()
+        if conn is None:
+            return
+        drop = self.server.should_drop()
+        stop_at = len(data)//2 if drop else len(data)
+        block_size = self.server.block_size()
+        with conn:
+            for start in range(0,stop_at,block_size):
+                block = data[start:min(start+block_size,stop_at)]
+                self.server.throttle(len(block))
+                conn.sendall(block)
+                self.server.count('bytes_sent',len(block))
+        if drop:
+            self.server.count('dropped')
+            raise InjectedDrop()
+        self.reply('226 Transfer complete.')
+
+class LocalFTPServer(socketserver.ThreadingTCPServer):
+    ''' Local FTP server serving files from root, mirroring the layout of the AI Weather Quest FTP site.
+
+    Parameters:
+        root (str): Directory served as the FTP root. Top level folders are created with create_remote_layout.
+        host (str): Address to listen on.
+        port (int): Port to listen on. 0 picks a free port, available afterwards as server.port.
+        password (str): Optional password. If None any password is accepted.
+        latency (float): Seconds added before every reply on the control connection.
+        bandwidth (float): Optional cap on data transfers in bytes per second, shared between all connections.
+        drop_rate (float): Probability that a data transfer is cut half way through and the connection closed.
+        error_550_rate (float): Probability that a command on a path (CWD, MKD, DELE, SIZE, LIST, RETR, STOR) fails with 550.
+        fail_paths (list): Glob patterns of remote paths that always fail with 550, e.g. ['/observations/*'].
+        seed (int): Optional seed so injected faults are reproducible.
+
+    Counters of connections, commands, bytes sent and received, dropped connections and injected 550 errors are kept in server.stats.
+    '''
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self,root,host='127.0.0.1',port=0,password=None,latency=0.0,bandwidth=None,drop_rate=0.0,error_550_rate=0.0,fail_paths=[],seed=None):
+        self.root = os.path.abspath(root)
+        self.password = password
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.drop_rate = drop_rate
+        self.error_550_rate = error_550_rate
+        self.fail_paths = list(fail_paths)
+        self.random = random.Random(seed)
+        self.stats = dict(connections=0,commands=0,bytes_sent=0,bytes_received=0,dropped=0,injected_550=0)
+        self._lock = threading.Lock()
+        self._next_send_time = time.monotonic()
+        self._thread = None
+        create_remote_layout(self.root)
+        super().__init__((host,port),FTPHandler)
+        self.port = self.server_address[1]
+
+    def count(self,name,amount=1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def should_fail(self,remote):
+        if any(fnmatch.fnmatch(remote,pattern) for pattern in self.fail_paths):
+            return True
+        with self._lock:
+            return self.random.random() < self.error_550_rate
+
+    def should_drop(self):
+        with self._lock:
+            return self.random.random() < self.drop_rate
+
+    def block_size(self):
+        if self.bandwidth is None:
+            return 65536
+        return int(max(1024,min(65536,self.bandwidth/20))) # about 20 blocks a second so the cap is smooth
+
+    def throttle(self,num_bytes):
+        ''' Sleeps so that the total rate across all connections stays under the bandwidth cap.
+        '''
+        if self.bandwidth is None:
+            return
+        with self._lock:
+            now = time.monotonic()
+            send_time = max(self._next_send_time,now)
+            self._next_send_time = send_time+num_bytes/self.bandwidth
+        if send_time > now:
+            time.sleep(send_time-now)
+
+    def start(self):
+        ''' Serves in a background (daemon) thread.
+        '''
+        self._thread = threading.Thread(target=self.serve_forever,daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self,*args):
+        self.stop()
@@ -0,0 +1,129 @@
+# script that stores the observed quintile category of every week as one byte per grid point, so scoring does not need float observations and thresholds.
+import xarray as xr
+import numpy as np
+import os
+from AI_WQ_package import check_fc_submission
+from AI_WQ_package import retrieve_evaluation_data
+from AI_WQ_package import forecast_evaluation
+
+GRID_SHAPE = (181, 360)
+GRID_SIZE = GRID_SHAPE[0]*GRID_SHAPE[1] # bytes per week in the category file
+
+def archive_filenames(variable,archive_dir):
+    ''' Returns the category file (raw uint8, shaped (week, 181, 360)) and the file listing the week (Monday) dates in row order.
+    Observation weeks are the same for both forecast periods, so a single archive per variable serves period 1 and 2.
+    '''
+    return os.path.join(archive_dir,f'{variable}_obs_category.u8'), os.path.join(archive_dir,f'{variable}_obs_category_dates.txt')
+
+def read_archive_dates(variable,archive_dir):
+    _, dates_file = archive_filenames(variable,archive_dir)
+    if not os.path.exists(dates_file):
+        return []
+    with open(dates_file) as f:
+        return f.read().split()
+
+def add_week_to_archive(date,variable,password,archive_dir='.',cache_dir=None):
+    ''' Works out the observed quintile category of a week from retrieve_weekly_obs and retrieve_20yr_quintile_clim and appends it to the archive.
+
+    Parameters:
+        date (str): Monday date of the observation week in format '%Y%m%d'.
+        variable (str): Options include 'tas', 'mslp' and 'pr'.
+        password (str): Password for the AI Weather Quest FTP site.
+        archive_dir (str): Directory holding the archive.
+        cache_dir (str): Optional cache of previously downloaded files (see prefetch_evaluation_data).
+
+    Returns:
+        bool: True if the week was added, False if it was already in the archive.
+    '''
+    check_fc_submission.is_valid_date(date)
+    check_fc_submission.check_variable_in_list(variable,['tas','mslp','pr'])
+    if date in read_archive_dates(variable,archive_dir):
+        print(f"Week {date} is already in the {variable} archive.")
+        return False
+
+    obs = check_fc_submission.lat_descending(retrieve_evaluation_data.retrieve_weekly_obs(date,variable,password,cache_dir=cache_dir))
+    quintiles = check_fc_submission.lat_descending(retrieve_evaluation_data.retrieve_20yr_quintile_clim(date,variable,password,cache_dir=cache_dir))
+    obs = obs.transpose('latitude','longitude')
+    quintiles = quintiles.transpose('quantile','latitude','longitude')
+
+    category = forecast_evaluation.obs_quintile_category(obs.values,quintiles.values)
+    if category.shape != GRID_SHAPE:
+        raise ValueError(f"Observed category shape is {category.shape}, but expected {GRID_SHAPE}.")
+
+    os.makedirs(archive_dir,exist_ok=True)
+    category_file, dates_file = archive_filenames(variable,archive_dir)
+    dates = read_archive_dates(variable,archive_dir)
+    # append the category first so the date list never points beyond the end of the category file.
+    # Rows without a date (left by an interrupted write) are cut off first so the new row lines up with its date.
+    with open(category_file,'a+b') as f:
+        f.truncate(len(dates)*GRID_SIZE)
+        f.write(category.tobytes())
+    # the date list is replaced in one go so it is never left half written
+    partial_filename = dates_file+'.part'
+    with open(partial_filename,'w') as f:
+        f.write(''.join(archived_date+'\n' for archived_date in dates+[date]))
+    os.replace(partial_filename,dates_file)
+    print(f"Week {date} added to the {variable} archive.")
+    return True
+
+def open_category_archive(variable,archive_dir='.'):
+    ''' Memory-maps the archive of a variable. Nothing is read from disk until a week is indexed.
+
+    Returns:
+        tuple: numpy.memmap of uint8 shaped (week, 181, 360) and a dict mapping week date to row.
+    '''
+    category_file, _ = archive_filenames(variable,archive_dir)
+    dates = read_archive_dates(variable,archive_dir)
+    if not dates:
+        raise ValueError(f"No {variable} observed category archive found in '{archive_dir}'.")
+    if os.path.getsize(category_file) < len(dates)*GRID_SIZE:
+        raise ValueError(f"The {variable} observed category archive in '{archive_dir}' holds fewer weeks than its date list. Rebuild it with add_week_to_archive.")
+    categories = np.memmap(category_file,dtype=np.uint8,mode='r',shape=(len(dates),)+GRID_SHAPE)
+    return categories, {date: row for row, date in enumerate(dates)}
+
+def read_obs_category(date,variable,archive_dir='.'):
+    ''' Returns the observed category (0 to 4, 255 for missing) of a week as a (181, 360) uint8 array.
+    '''
+    categories, rows = open_category_archive(variable,archive_dir)
+    if date not in rows:
+        raise ValueError(f"Week {date} is not in the {variable} archive. Add it with add_week_to_archive.")
+    return np.asarray(categories[rows[date]])
+
+def save_land_sea_mask_bits(land_sea_mask,archive_dir='.'):
+    ''' Stores the land sea mask (land where >= 0.8, as in apply_land_sea_mask) as a bitmask, one bit per grid point.
+    land_sea_mask can be the output of retrieve_land_sea_mask.
+    '''
+    if isinstance(land_sea_mask,xr.DataArray):
+        land_sea_mask = check_fc_submission.lat_descending(land_sea_mask).transpose('latitude','longitude').values
+    land = np.asarray(land_sea_mask) >= 0.8
+    if land.shape != GRID_SHAPE:
+        raise ValueError(f"Land sea mask shape is {land.shape}, but expected {GRID_SHAPE}.")
+    os.makedirs(archive_dir,exist_ok=True)
+    np.save(os.path.join(archive_dir,'land_sea_mask_bits.npy'),np.packbits(land))
+
+def load_land_sea_mask_bits(archive_dir='.'):
+    ''' Returns the land sea mask saved by save_land_sea_mask_bits as a (181, 360) boolean array (True over land).
+    '''
+    bits = np.load(os.path.join(archive_dir,'land_sea_mask_bits.npy'))
+    return np.unpackbits(bits,count=GRID_SIZE).reshape(GRID_SHAPE).astype(bool)
+
+def RPSS_from_archive(fc_pbs,date,variable,archive_dir='.',lsm=True):
+    ''' Works out the RPSS of a forecast with respect to climatology using the archived observed category.
+
+    Parameters:
+        fc_pbs (xarray.DataArray): Forecast probabilities shaped (5, 181, 360) on the submission grid, e.g. the output of AI_WQ_forecast_submission.
+        date (str): Monday date of the verifying observation week.
+        variable (str): Options include 'tas', 'mslp' and 'pr'.
+        archive_dir (str): Directory holding the archive.
+        lsm (bool): If True, only land points are scored using the bitmask saved by save_land_sea_mask_bits.
+
+    Returns:
+        xarray.DataArray: RPSS with latitude and longitude coordinates, which can be passed to weighted_mean_calc.
+    '''
+    obs_category = read_obs_category(date,variable,archive_dir)
+    RPS_score_fc, RPS_score_clim = forecast_evaluation.RPS_from_category(np.asarray(fc_pbs),obs_category)
+    RPSS_wrt_clim = 1-(RPS_score_fc/RPS_score_clim)
+    if lsm == True:
+        RPSS_wrt_clim[~load_land_sea_mask_bits(archive_dir)] = np.nan
+    return xr.DataArray(data=RPSS_wrt_clim,dims=['latitude','longitude'],
+                        coords=dict(latitude=np.arange(90.0,-91.0,-1.0),longitude=np.arange(0.0,360.0,1.0)))
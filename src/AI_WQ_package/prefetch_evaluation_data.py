@@ -0,0 +1,161 @@
+# script that works out from the competition calendar which observations and climatologies each forecast needs and downloads them in the background.
+import ftplib
+import os
+import threading
+from datetime import datetime, timedelta
+from AI_WQ_package import check_fc_submission
+from AI_WQ_package import ftp_connection
+from AI_WQ_package import retrieve_evaluation_data
+
+# first day of each forecasting period, in days from the (Thursday) forecast start date. Both fall on a Monday.
+FC_PERIOD_START_DAYS = {'1':18,'2':25}
+
+def evaluation_week_start(fc_start_date,fc_period):
+    ''' Returns the Monday (as '%Y%m%d') that starts the observation week verifying a forecast period.
+
+    Parameters:
+        fc_start_date (str): The forecast start date as a string in format '%Y%m%d'. Should be a Thursday.
+        fc_period (str or number): Either forecast period 1 (days 18 to 24) for forecast period 2 (days 25 to 31).
+
+    Returns:
+        str: Monday date of the observation week, i.e. the date used by retrieve_weekly_obs and retrieve_20yr_quintile_clim.
+    '''
+    check_fc_submission.is_valid_date(fc_start_date)
+    fc_period = check_fc_submission.convert_fc_period_to_string(fc_period)
+    check_fc_submission.check_variable_in_list(fc_period,['1','2'])
+
+    date_obj = datetime.strptime(fc_start_date,'%Y%m%d')
+    # Thursday + 18 or 25 days is always a Monday
+    week_start = date_obj+timedelta(days=FC_PERIOD_START_DAYS[fc_period])
+    return week_start.strftime('%Y%m%d')
+
+def required_evaluation_files(fc_start_date,variables=['tas','mslp','pr'],fc_periods=['1','2']):
+    ''' Lists every observation and climatology file needed to score a forecast.
+
+    Returns:
+        list of tuples: (kind, date, variable, available_from) where kind is 'obs' or 'clim' and available_from is the earliest datetime the file can exist remotely.
+    '''
+    required = []
+    for fc_period in fc_periods:
+        week_start = evaluation_week_start(fc_start_date,fc_period)
+        week_start_obj = datetime.strptime(week_start,'%Y%m%d')
+        for variable in variables:
+            check_fc_submission.check_variable_in_list(variable,['tas','mslp','pr'])
+            # climatologies are computed in advance so can be fetched straight away
+            required.append(('clim',week_start,variable,datetime.min))
+            # observations only exist once the verifying week (Monday to Sunday) has finished
+            required.append(('obs',week_start,variable,week_start_obj+timedelta(days=7)))
+    return required
+
+def download_if_available(session,remote_path,local_filename):
+    ''' Downloads remote_path to local_filename if it exists on the FTP site.
+    The file is written to a temporary name first (see retrieve_evaluation_data.download_file) so a partial download is never mistaken for a complete file.
+
+    Returns:
+        bool: True if the file was downloaded, False if it is not yet on the FTP site.
+    '''
+    try:
+        retrieve_evaluation_data.download_file(session,remote_path,local_filename)
+    except ftplib.error_perm as e:
+        if "550" in str(e): # "550" is the FTP error code for file not found
+            return False
+        raise
+    print(f"File '{remote_path}' has been prefetched to '{local_filename}'.")
+    return True
+
+class EvaluationPrefetcher:
+    ''' Background scheduler that prefetches the observations and climatologies needed to score pending forecasts.
+    Files are saved to cache_dir, which should then be passed to retrieve_weekly_obs and retrieve_20yr_quintile_clim.
+
+    Parameters:
+        password (str): Password for the AI Weather Quest FTP site.
+        cache_dir (str): Directory in which to store downloaded files.
+        variables (list): Variables to prefetch. Options include 'tas', 'mslp' and 'pr'.
+        poll_interval (float): Seconds between checks of the FTP site for newly published files.
+
+    Example:
+        prefetcher = EvaluationPrefetcher(password,'eval_cache')
+        prefetcher.add_forecast('20241212')
+        prefetcher.start()
+    '''
+    def __init__(self,password,cache_dir='.',variables=['tas','mslp','pr'],poll_interval=3600.0):
+        self.password = password
+        self.cache_dir = cache_dir
+        self.variables = list(variables)
+        self.poll_interval = poll_interval
+        self.pending = {} # (kind, date, variable) -> available_from
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        os.makedirs(cache_dir,exist_ok=True)
+
+    def _filenames(self,kind,date,variable):
+        if kind == 'clim':
+            local_filename, remote_path = retrieve_evaluation_data.clim_filenames(date,variable)
+        else:
+            local_filename, remote_path = retrieve_evaluation_data.obs_filenames(date,variable)
+        return os.path.join(self.cache_dir,local_filename), remote_path
+
+    def add_forecast(self,fc_start_date,fc_periods=['1','2']):
+        ''' Adds the observations and climatologies needed by a forecast to the pending list. Files already in cache_dir are skipped.
+        '''
+        with self._lock:
+            for kind, date, variable, available_from in required_evaluation_files(fc_start_date,self.variables,fc_periods):
+                local_filename, remote_path = self._filenames(kind,date,variable)
+                if not os.path.exists(local_filename):
+                    self.pending[(kind,date,variable)] = available_from
+
+    def run_once(self,now=None):
+        ''' Checks the FTP site once for all pending files whose calendar date has passed and downloads those that exist.
+        Only a single FTP session is opened, and only if there is something due.
+
+        Returns:
+            int: Number of files downloaded.
+        '''
+        if now is None:
+            now = datetime.utcnow()
+        with self._lock:
+            due = sorted(key for key, available_from in self.pending.items() if available_from <= now)
+        if not due:
+            return 0
+
+        num_downloaded = 0
+        session = ftp_connection.open_ftp_session(self.password)
+        try:
+            for kind, date, variable in due:
+                if self._stop_event.is_set():
+                    break
+                local_filename, remote_path = self._filenames(kind,date,variable)
+                if download_if_available(session,remote_path,local_filename):
+                    num_downloaded += 1
+                    with self._lock:
+                        self.pending.pop((kind,date,variable),None)
+        finally:
+            session.quit()
+        return num_downloaded
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except ftplib.all_errors as e:
+                # network problems should not kill the scheduler, try again at the next poll
+                print(f"Prefetch attempt failed: {e}")
+            self._stop_event.wait(self.poll_interval)
+
+    def start(self):
+        ''' Starts polling the FTP site in a background (daemon) thread.
+        '''
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run,daemon=True)
+        self._thread.start()
+
+    def stop(self,timeout=None):
+        ''' Stops the background thread after the current download has finished.
+        '''
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
@@ -0,0 +1,150 @@
+# script that regrids forecast probabilities from any global latitude-longitude grid to the 1 deg submission grid.
+import xarray as xr
+import numpy as np
+import scipy.sparse
+import hashlib
+import os
+
+# target (submission) grid. Latitudes 90 to -90, longitudes 0 to 359.
+TARGET_LATITUDES = np.arange(90.0,-91.0,-1.0)
+TARGET_LONGITUDES = np.arange(0.0,360.0,1.0)
+
+# bumped whenever the weight calculation changes, so weights saved to disk by an older version are not reused
+WEIGHTS_VERSION = 2
+
+# in-memory store of weights already computed or loaded during this session
+_weights_cache = {}
+
+def find_coord_name(da,possible_names,coord_type):
+    ''' Returns the first name in possible_names that is a coordinate of da.
+    '''
+    for name in possible_names:
+        if name in da.coords:
+            return name
+    raise ValueError(f"{coord_type} coordinate not found in the dataset. Tried '{possible_names}.'")
+
+def lat_cell_bounds(lats):
+    ''' Works out cell bounds from ascending latitude centres. Outer bounds are set to the poles.
+    '''
+    mid = 0.5*(lats[1:]+lats[:-1])
+    return np.concatenate([[-90.0],mid,[90.0]])
+
+def lon_cell_bounds(lons):
+    ''' Works out cell bounds from ascending longitude centres (0 to 360), assuming a periodic global grid.
+    '''
+    wrapped = np.concatenate([[lons[-1]-360.0],lons,[lons[0]+360.0]])
+    return 0.5*(wrapped[1:]+wrapped[:-1])
+
+def conservative_weights_1d(src_bounds,tgt_bounds,periodic=False):
+    ''' Returns a (n_target, n_source) matrix of the overlap between each target and source cell, normalised by the target cell size.
+    For latitude, pass bounds as sin(latitude) so that the overlap is proportional to area.
+    '''
+    src_lo, src_hi = src_bounds[:-1], src_bounds[1:]
+    tgt_lo, tgt_hi = tgt_bounds[:-1,None], tgt_bounds[1:,None]
+    shifts = [-360.0,0.0,360.0] if periodic else [0.0]
+    overlap = np.zeros((tgt_lo.shape[0],src_lo.shape[0]))
+    for shift in shifts:
+        overlap += np.clip(np.minimum(tgt_hi,src_hi+shift)-np.maximum(tgt_lo,src_lo+shift),0.0,None)
+    return overlap/overlap.sum(axis=1,keepdims=True)
+
+def bilinear_weights_1d(src,tgt,periodic=False):
+    ''' Returns a (n_target, n_source) matrix of linear interpolation weights from ascending source points to target points.
+    Targets outside the source range take the value of the nearest source point (unless periodic).
+    '''
+    n_src = src.shape[0]
+    src_index = np.arange(n_src)
+    if periodic:
+        # wrap around both ends so targets either side of the 360/0 seam are interpolated across it
+        src = np.concatenate([[src[-1]-360.0],src,[src[0]+360.0]])
+        src_index = np.concatenate([[n_src-1],src_index,[0]])
+    upper = np.clip(np.searchsorted(src,tgt,side='right'),1,src.shape[0]-1)
+    lower = upper-1
+    frac = np.clip((tgt-src[lower])/(src[upper]-src[lower]),0.0,1.0)
+    weights = np.zeros((tgt.shape[0],n_src))
+    rows = np.arange(tgt.shape[0])
+    np.add.at(weights,(rows,src_index[lower]),1.0-frac)
+    np.add.at(weights,(rows,src_index[upper]),frac)
+    return weights
+
+def compute_regrid_weights(src_lats,src_lons,method='conservative'):
+    ''' Builds a sparse matrix mapping a flattened (lat, lon) source field to the flattened 1 deg submission grid.
+    src_lats and src_lons should be ascending (latitude) and within 0 to 360 (longitude).
+    Both methods are separable on rectilinear grids (regular lat-lon or regular Gaussian), so the 2D weights are the Kronecker product of 1D weights.
+    '''
+    tgt_lats = TARGET_LATITUDES
+    if method == 'conservative':
+        tgt_lat_bounds = np.clip(np.concatenate([tgt_lats+0.5,[tgt_lats[-1]-0.5]]),-90.0,90.0)[::-1] # ascending
+        lat_w = conservative_weights_1d(np.sin(np.deg2rad(lat_cell_bounds(src_lats))),np.sin(np.deg2rad(tgt_lat_bounds)))[::-1] # back to 90 to -90
+        tgt_lon_bounds = np.concatenate([TARGET_LONGITUDES-0.5,[TARGET_LONGITUDES[-1]+0.5]])
+        lon_w = conservative_weights_1d(lon_cell_bounds(src_lons),tgt_lon_bounds,periodic=True)
+    elif method == 'bilinear':
+        lat_w = bilinear_weights_1d(src_lats,tgt_lats)
+        lon_w = bilinear_weights_1d(src_lons,TARGET_LONGITUDES,periodic=True)
+    else:
+        raise ValueError(f"Regridding method '{method}' not recognised. Options are 'conservative' or 'bilinear'.")
+    lat_w[lat_w < 1e-12] = 0.0
+    lon_w[lon_w < 1e-12] = 0.0
+    return scipy.sparse.kron(scipy.sparse.csr_matrix(lat_w),scipy.sparse.csr_matrix(lon_w),format='csr')
+
+def get_regrid_weights(src_lats,src_lons,method='conservative',cache_dir=None):
+    ''' Returns regridding weights for a source grid, computing them only once.
+    Weights are kept in memory and, if cache_dir is given, saved to disk as a .npz file named after a hash of the source grid.
+    '''
+    grid_hash = hashlib.sha1(np.ascontiguousarray(src_lats,dtype=np.float64).tobytes()+np.ascontiguousarray(src_lons,dtype=np.float64).tobytes()).hexdigest()[:16]
+    key = (method,grid_hash)
+    if key in _weights_cache:
+        return _weights_cache[key]
+
+    cache_file = None
+    if cache_dir is not None:
+        cache_file = os.path.join(cache_dir,f'regrid_weights_v{WEIGHTS_VERSION}_{method}_{grid_hash}.npz')
+        if os.path.exists(cache_file):
+            weights = scipy.sparse.load_npz(cache_file).tocsr()
+            _weights_cache[key] = weights
+            return weights
+
+    print(f"Computing {method} regridding weights for a {src_lats.shape[0]}x{src_lons.shape[0]} source grid.")
+    weights = compute_regrid_weights(src_lats,src_lons,method=method)
+    if cache_file is not None:
+        os.makedirs(cache_dir,exist_ok=True)
+        scipy.sparse.save_npz(cache_file,weights)
+    _weights_cache[key] = weights
+    return weights
+
+def regrid_to_submission_grid(da,method='conservative',cache_dir=None):
+    ''' Regrids forecast probabilities from a global latitude-longitude grid (e.g. 0.25 deg or regular Gaussian) to the 1 deg submission grid.
+
+    Parameters:
+        da (xarray.DataArray): Forecast probabilities with a quintile, latitude and longitude coordinate.
+        method (str): Either 'conservative' (area-weighted) or 'bilinear'.
+        cache_dir (str): Optional directory where regridding weights are saved so they are only computed once per source grid.
+
+    Returns:
+        xarray.DataArray: Probabilities shaped (quintile, latitude, longitude) on the 1 deg grid (90 to -90, 0 to 359). Probabilities are renormalised to sum to one. Grid points only covered by NaNs are NaN.
+    '''
+    lat_name = find_coord_name(da,['latitude', 'lat', 'latitudes', 'lat_deg', 'y'],'Latitude')
+    lon_name = find_coord_name(da,['longitude', 'lon', 'longitudes', 'lon_deg', 'x'],'Longitude')
+    q_name = find_coord_name(da,['quintile', 'Quintile', 'q', 'percentile', 'Q'],'Quintile')
+
+    # sort the source grid so latitudes ascend and longitudes run from 0 to 360.
+    da = da.assign_coords({lon_name: da[lon_name].values % 360.0}).sortby([lat_name,lon_name]).transpose(q_name,lat_name,lon_name)
+    src_lats = da[lat_name].values.astype(np.float64)
+    src_lons = da[lon_name].values.astype(np.float64)
+
+    weights = get_regrid_weights(src_lats,src_lons,method=method,cache_dir=cache_dir)
+
+    # (source points, quintile) so all five layers are regridded in a single sparse matrix product.
+    data = da.values.reshape(da.shape[0],-1).T
+    missing = np.isnan(data)
+    regridded = weights @ np.where(missing,0.0,data)
+    # only use weights from valid source points
+    valid_weight = weights @ (~missing).astype(np.float64)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        regridded = np.where(valid_weight > 0.0,regridded/valid_weight,np.nan)
+        # renormalise so probabilities sum to one across the quintile axis
+        regridded = regridded/regridded.sum(axis=1,keepdims=True)
+
+    regridded = regridded.T.reshape(da.shape[0],TARGET_LATITUDES.shape[0],TARGET_LONGITUDES.shape[0])
+    return xr.DataArray(data=regridded,dims=[q_name,'latitude','longitude'],
+                        coords={q_name:da[q_name].values,'latitude':TARGET_LATITUDES,'longitude':TARGET_LONGITUDES},
+                        attrs=da.attrs)
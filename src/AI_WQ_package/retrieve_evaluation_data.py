@@ -5,7 +5,8 @@ import pandas as pd
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 from AI_WQ_package import check_fc_submission
-import ftplib
+from AI_WQ_package import ftp_connection
+import os
 
 def change_lat_long_coord_names(da):
     da = da.rename({'lat':'latitude'})
@@ -18,15 +19,16 @@ def retrieve_land_sea_mask(password):
     local_filename = f'land_sea_mask_1DEG.nc'
 
     # log onto FTP session
-    session = ftplib.FTP('ftp.ecmwf.int','ai_weather_quest',password)
+    session = ftp_connection.open_ftp_session(password)
     remote_path = f'land_sea_mask_1DEG.nc'
     # retrieve the full year file 
-    with open(local_filename,'wb') as f:
-        session.retrbinary(f"RETR {remote_path}", f.write)
+    try:
+        download_file(session,remote_path,local_filename)
+    finally:
+        session.quit()
 
     print(f"File '{remote_path}' has been downloaded to successfully.")
 
-    session.quit()
     # downloaded single climatological file #### 
     # open file using xarray.
     # when opening, drop the time coordinate from the xarray.
@@ -36,39 +38,60 @@ def retrieve_land_sea_mask(password):
     return land_sea_mask
 
 
-def retrieve_20yr_quintile_clim(date,variable,password):
+def download_file(session,remote_path,local_filename):
+    ''' Downloads remote_path to local_filename. The file is written to a temporary name first and only renamed once complete,
+    so a failed or interrupted transfer never leaves a partial file that would later be mistaken for a cached download.
     '''
+    partial_filename = local_filename+'.part'
+    with open(partial_filename,'wb') as f: # opened outside the try, so only a partial file that was actually created is removed
+        try:
+            session.retrbinary(f"RETR {remote_path}", f.write)
+        except BaseException:
+            f.close()
+            os.remove(partial_filename)
+            raise
+    os.replace(partial_filename,local_filename)
+
+def clim_filenames(date,variable):
+    ''' Returns the local filename and remote FTP path of the 20-year quintile climatology for a given date and variable.
     '''
     # get year of date variable. #######
-    
+    str_year = str(datetime.strptime(date,'%Y%m%d').year)
+
+    local_filename = f'{variable}_20yrCLIM_WEEKLYMEAN_quintiles_{date}.nc'
+    if variable == 'tas' or variable == 'mslp':
+        remote_path = f'/climatologies/{str_year}/{variable}_20yrCLIM_WEEKLYMEAN_quintiles_{date}.nc'
+    elif variable == 'pr':
+        remote_path = f'/climatologies/{str_year}/{variable}_20yrCLIM_WEEKLYSUM_quintiles_{date}.nc'
+    return local_filename, remote_path
+
+def retrieve_20yr_quintile_clim(date,variable,password,cache_dir=None):
+    '''
+    cache_dir = optional directory holding previously downloaded files (see prefetch_evaluation_data). If the file is already there, it is opened without logging onto the FTP site.
+    '''
     # check date input in valid
     check_fc_submission.is_valid_date(date)
-    # get a data obj
-    date_obj = datetime.strptime(date,'%Y%m%d')
-    # get the year component
-    year = date_obj.year
-    str_year = str(year)
 
     # check variable is valid
     check_fc_submission.check_variable_in_list(variable,['tas','mslp','pr'])
 
     #### copy across single day climatological file ####
     # create a local filename ###
-    local_filename = f'{variable}_20yrCLIM_WEEKLYMEAN_quintiles_{date}.nc'
-
-    # log onto FTP session
-    session = ftplib.FTP('ftp.ecmwf.int','ai_weather_quest',password) 
-    if variable == 'tas' or variable == 'mslp':
-        remote_path = f'/climatologies/{str_year}/{variable}_20yrCLIM_WEEKLYMEAN_quintiles_{date}.nc'
-    elif variable == 'pr':
-        remote_path = f'/climatologies/{str_year}/{variable}_20yrCLIM_WEEKLYSUM_quintiles_{date}.nc'
-    # retrieve the full year file 
-    with open(local_filename,'wb') as f:
-        session.retrbinary(f"RETR {remote_path}", f.write)
+    local_filename, remote_path = clim_filenames(date,variable)
+    if cache_dir is not None:
+        os.makedirs(cache_dir,exist_ok=True)
+        local_filename = os.path.join(cache_dir,local_filename)
+
+    if cache_dir is None or not os.path.exists(local_filename):
+        # log onto FTP session
+        session = ftp_connection.open_ftp_session(password)
+        # retrieve the full year file 
+        try:
+            download_file(session,remote_path,local_filename)
+        finally:
+            session.quit()
   
-    print(f"File '{remote_path}' has been downloaded to successfully.")
-
-    session.quit()
+        print(f"File '{remote_path}' has been downloaded to successfully.")
     # downloaded single climatological file #### 
     # open file using xarray.
     single_day_clim = xr.open_dataarray(local_filename).squeeze()
@@ -76,35 +99,44 @@ def retrieve_20yr_quintile_clim(date,variable,password):
     # return the single day climatology.
     return single_day_clim
 
-def retrieve_weekly_obs(date,variable,password):
+def obs_filenames(date,variable):
+    ''' Returns the local filename and remote FTP path of the weekly observations for a given week (Monday date) and variable.
+    '''
+    if variable == 'tas' or variable == 'mslp':
+        local_filename = f'ERA5T_sfc_inst_{variable}_{date}_WEEKMEAN.nc'
+    elif variable == 'pr':
+        local_filename = f'pr_MSWEP_1DEG_{date}_WEEKACCUM.nc'
+    remote_path = f'/observations/{date}/{local_filename}'
+    return local_filename, remote_path
+
+def retrieve_weekly_obs(date,variable,password,cache_dir=None):
     '''
     date = date of observational week
+    cache_dir = optional directory holding previously downloaded files (see prefetch_evaluation_data). If the file is already there, it is opened without logging onto the FTP site.
     '''
     # check date input in valid
     check_fc_submission.is_valid_date(date)
-    # get a data obj
-    date_obj = datetime.strptime(date,'%Y%m%d')
 
     # check variable is valid
     check_fc_submission.check_variable_in_list(variable,['tas','mslp','pr'])
 
     #### copy across single day climatological file ####
     # create a local filename ###
-    if variable == 'tas' or variable == 'mslp':
-        local_filename = f'ERA5T_sfc_inst_{variable}_{date}_WEEKMEAN.nc'
-    elif variable == 'pr':
-        local_filename = f'pr_MSWEP_1DEG_{date}_WEEKACCUM.nc'
-
-    # log onto FTP session
-    session = ftplib.FTP('ftp.ecmwf.int','ai_weather_quest',password)
-    remote_path = f'/observations/{date}/{local_filename}'
-    # retrieve the full year file 
-    with open(local_filename,'wb') as f:
-        session.retrbinary(f"RETR {remote_path}", f.write)
-
-    print(f"File '{remote_path}' has been downloaded to successfully.")
-
-    session.quit()
+    local_filename, remote_path = obs_filenames(date,variable)
+    if cache_dir is not None:
+        os.makedirs(cache_dir,exist_ok=True)
+        local_filename = os.path.join(cache_dir,local_filename)
+
+    if cache_dir is None or not os.path.exists(local_filename):
+        # log onto FTP session
+        session = ftp_connection.open_ftp_session(password)
+        # retrieve the full year file 
+        try:
+            download_file(session,remote_path,local_filename)
+        finally:
+            session.quit()
+
+        print(f"File '{remote_path}' has been downloaded to successfully.")
     # open file using xarray. # removes time bounds
     weekly_obs = xr.open_dataset(local_filename).squeeze().drop_dims('bnds').drop_vars('time_bnds',errors='ignore').to_array().squeeze()
     # return the single day climatology.
@@ -5,7 +5,8 @@ import pandas as pd
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 from AI_WQ_package import check_fc_submission
-import ftplib
+from AI_WQ_package import ftp_connection
+from AI_WQ_package import retrieve_evaluation_data
 
 def retrieve_annual_training_data(year,variable,password):
     '''
@@ -24,15 +25,16 @@ def retrieve_annual_training_data(year,variable,password):
         local_filename = f'{variable}_sevenday_WEEKLYSUM_{year}.nc'
 
     # log onto FTP session
-    session = ftplib.FTP('ftp.ecmwf.int','ai_weather_quest',password)
+    session = ftp_connection.open_ftp_session(password)
     remote_path = f'/training_data/{local_filename}'
     # retrieve the full year file 
-    with open(local_filename,'wb') as f:
-        session.retrbinary(f"RETR {remote_path}", f.write)
+    try:
+        retrieve_evaluation_data.download_file(session,remote_path,local_filename)
+    finally:
+        session.quit()
 
     print(f"File '{remote_path}' has been downloaded to successfully.")
 
-    session.quit()
     # open file using xarray. # removes time bounds
     full_year_obs = xr.open_dataset(local_filename).squeeze()
     return full_year_obs
@@ -0,0 +1,201 @@
+# long-running service that watches a directory for forecast files and submits them over a persistent FTP connection.
+import xarray as xr
+import ftplib
+import hashlib
+import json
+import os
+import time
+import argparse
+from datetime import datetime
+from AI_WQ_package import forecast_submission
+from AI_WQ_package import ftp_connection
+
+def parse_forecast_filename(filename):
+    ''' Splits a filename of the form {variable}_{fc_start_date}_p{fc_period}_{teamname}_{modelname}.nc, as output by check_fc_submission.all_checks.
+    The modelname may contain underscores, the other components may not.
+
+    Returns:
+        tuple: (variable, fc_start_date, fc_period, teamname, modelname)
+    '''
+    name, extension = os.path.splitext(os.path.basename(filename))
+    parts = name.split('_',4)
+    if extension != '.nc' or len(parts) != 5 or not parts[2].startswith('p'):
+        raise ValueError(f"Filename '{filename}' does not follow the format 'variable_fcstartdate_pN_teamname_modelname.nc'.")
+    variable, fc_start_date, fc_period, teamname, modelname = parts
+    return variable, fc_start_date, fc_period[1:], teamname, modelname
+
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path,'rb') as f:
+        for block in iter(lambda: f.read(1<<20),b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+class SubmissionService:
+    ''' Watches a directory for new forecast files, checks them and submits them to the AI Weather Quest over a single, reused FTP session.
+
+    Forecast files should hold a single (quintile, lat, long) DataArray and be named {variable}_{fc_start_date}_p{fc_period}_{teamname}_{modelname}.nc.
+    A file is only picked up once it has not been modified for settle_time seconds, so files still being written are left alone.
+    Files whose contents have already been submitted are not submitted again, and files that fail the checks are only tried again once they are modified.
+    Each scan makes a single attempt per file, so a file that cannot be transferred never holds up the others. It is rescheduled for a later scan instead, waiting retry_delay seconds,
+    doubled after every failed attempt. The state of every file, including the time of its next attempt, is written to status_file (JSON).
+
+    Parameters:
+        password (str): The forecast submission portal password.
+        watch_dir (str): Directory to watch for forecast files.
+        status_file (str): JSON file reporting the status of every file. Defaults to watch_dir/submission_status.json.
+        poll_interval (float): Seconds between scans of watch_dir.
+        settle_time (float): Seconds a file must be unmodified before it is submitted.
+        max_retries (int): Number of times the retry delay is doubled. Files keep being retried at the longest delay after that, so a forecast is still submitted after a long outage.
+        retry_delay (float): Seconds before the first retry, doubled after every failed attempt.
+    '''
+    def __init__(self,password,watch_dir,status_file=None,poll_interval=2.0,settle_time=2.0,max_retries=5,retry_delay=5.0):
+        self.password = password
+        self.watch_dir = watch_dir
+        self.status_file = status_file if status_file is not None else os.path.join(watch_dir,'submission_status.json')
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.session = None
+        self.status = {}
+        if os.path.exists(self.status_file):
+            with open(self.status_file) as f:
+                self.status = json.load(f) # previous status is kept so submitted files are not resubmitted after a restart
+
+    def connect(self):
+        ''' Returns an open FTP session, checking that an existing session is still alive and reconnecting if not.
+        '''
+        if self.session is not None:
+            try:
+                self.session.voidcmd('NOOP')
+                return self.session
+            except ftplib.all_errors:
+                self.close()
+        self.session = ftp_connection.open_ftp_session(self.password)
+        return self.session
+
+    def close(self):
+        if self.session is not None:
+            try:
+                self.session.quit()
+            except ftplib.all_errors:
+                pass
+            self.session = None
+
+    def update_status(self,filename,**fields):
+        self.status[filename] = {**self.status.get(filename,{}),**fields,'updated':datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')}
+        partial_filename = self.status_file+'.part'
+        with open(partial_filename,'w') as f:
+            json.dump(self.status,f,indent=1)
+        os.replace(partial_filename,self.status_file) # readers never see a half-written status file
+
+    def reschedule(self,filename,status,sha256,attempts,error):
+        ''' Records a failed attempt and schedules the next one, with the delay doubling after every failed attempt (at most max_retries times).
+        '''
+        delay = self.retry_delay*2**min(attempts-1,self.max_retries)
+        print(f"Attempt {attempts} to submit '{filename}' failed: {type(error).__name__}: {error}. Trying again in {delay:.0f} s.")
+        self.update_status(filename,status=status,sha256=sha256,attempts=attempts,next_attempt=time.time()+delay,message=f'{type(error).__name__}: {error}')
+        return status
+
+    def submit_file(self,path):
+        ''' Checks and submits a single forecast file. Only one attempt is made, failed transfers are rescheduled for a later scan.
+
+        Files that cannot be read or fail the checks are marked 'invalid'. Files that fail to transfer are marked 'retrying', and files that hit an unexpected error 'failed'.
+        Both are tried again by a later scan once their next_attempt time has passed.
+
+        Returns:
+            str: 'submitted', 'duplicate', 'invalid', 'retrying' or 'failed'.
+        '''
+        filename = os.path.basename(path)
+        sha256 = file_sha256(path)
+        previous = self.status.get(filename,{})
+        if previous.get('sha256') == sha256 and previous.get('status') in ('submitted','invalid'):
+            return 'duplicate'
+        # attempts and latency are counted from the first attempt to submit these contents
+        if previous.get('sha256') == sha256 and previous.get('status') in ('retrying','failed'):
+            attempts, received = previous.get('attempts',0)+1, previous.get('first_attempt',time.time())
+        else:
+            attempts, received = 1, time.time()
+            self.update_status(filename,first_attempt=received)
+
+        try:
+            variable, fc_start_date, fc_period, teamname, modelname = parse_forecast_filename(filename)
+            with xr.open_dataarray(path) as data:
+                data = data.load()
+        except Exception as e: # any file that cannot be read is reported rather than stopping the service
+            self.update_status(filename,status='invalid',sha256=sha256,message=f'{type(e).__name__}: {e}')
+            return 'invalid'
+
+        try:
+            forecast_submission.AI_WQ_forecast_submission(data,self.password,variable,fc_start_date,fc_period,teamname,modelname,session=self.connect())
+        except ValueError as e: # raised by the checks in check_fc_submission, retrying will not help
+            self.update_status(filename,status='invalid',sha256=sha256,message=str(e))
+            return 'invalid'
+        except ftplib.all_errors as e:
+            self.close()
+            return self.reschedule(filename,'retrying',sha256,attempts,e)
+        except Exception as e: # unexpected error in the checks or the upload
+            self.close()
+            return self.reschedule(filename,'failed',sha256,attempts,e)
+        self.update_status(filename,status='submitted',sha256=sha256,attempts=attempts,next_attempt=None,message='',
+                           latency_seconds=round(time.time()-received,3))
+        return 'submitted'
+
+    def scan(self):
+        ''' Submits every settled forecast file in watch_dir that has not yet been submitted, and retries files whose next attempt is due.
+
+        Returns:
+            dict: filename to result of submit_file for the files handled in this scan.
+        '''
+        results = {}
+        now = time.time()
+        for filename in sorted(os.listdir(self.watch_dir)):
+            path = os.path.join(self.watch_dir,filename)
+            if not filename.endswith('.nc') or not os.path.isfile(path):
+                continue
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue # removed since the directory was listed
+            if now-mtime < self.settle_time:
+                continue # still being written
+            previous = self.status.get(filename,{})
+            if previous.get('mtime') == mtime:
+                if previous.get('status') in ('submitted','invalid'):
+                    continue # unchanged since it was last handled
+                if previous.get('status') in ('retrying','failed') and now < previous.get('next_attempt',0):
+                    continue # waiting before the next attempt
+            try:
+                results[filename] = self.submit_file(path)
+            except Exception as e: # e.g. the file was removed while being submitted. Carry on with the other files
+                results[filename] = self.reschedule(filename,'failed',None,previous.get('attempts',0)+1,e)
+            self.update_status(filename,mtime=mtime)
+        return results
+
+    def run_forever(self):
+        ''' Scans watch_dir every poll_interval seconds until interrupted.
+        '''
+        print(f"Watching '{self.watch_dir}' for forecast files. Status is written to '{self.status_file}'.")
+        try:
+            while True:
+                for filename, result in self.scan().items():
+                    print(f"'{filename}': {result}")
+                time.sleep(self.poll_interval)
+        except KeyboardInterrupt:
+            print('Stopping submission service.')
+        finally:
+            self.close()
+
+if __name__ == '__main__':
+    # e.g. AI_WQ_PASSWORD=... python -m AI_WQ_package.submission_service /path/to/model/output
+    parser = argparse.ArgumentParser(description='Watch a directory and submit forecast files to the AI Weather Quest.')
+    parser.add_argument('watch_dir',help='directory that forecast files are written to')
+    parser.add_argument('--status-file',default=None,help='JSON file reporting the status of every file')
+    parser.add_argument('--poll-interval',type=float,default=2.0,help='seconds between directory scans')
+    args = parser.parse_args()
+
+    password = os.environ.get('AI_WQ_PASSWORD')
+    if password is None:
+        raise ValueError('Set the AI_WQ_PASSWORD environment variable to the forecast submission portal password.')
+    SubmissionService(password,args.watch_dir,status_file=args.status_file,poll_interval=args.poll_interval).run_forever()
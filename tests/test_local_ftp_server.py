@@ -0,0 +1,269 @@
+# runs every FTP transfer path of the package against local_ftp_server under injected latency, a bandwidth cap, dropped connections and 550 errors.
+import ftplib
+import json
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from AI_WQ_package import check_fc_submission
+from AI_WQ_package import forecast_submission
+from AI_WQ_package import ftp_connection
+from AI_WQ_package import local_ftp_server
+from AI_WQ_package import prefetch_evaluation_data
+from AI_WQ_package import retrieve_evaluation_data
+from AI_WQ_package import retrieve_training_data
+from AI_WQ_package import submission_service
+
+PASSWORD = 'test_password'
+FC_START_DATE = '20241212' # Thursday, forecast period 1 is verified by the week starting Monday 20241230
+OBS_DATE = '20241230'
+
+# faults injected by the server. Transfers should succeed under latency and the bandwidth cap, and fail cleanly under drops and 550 errors.
+CONDITIONS = {'latency':dict(latency=0.01),
+              'bandwidth':dict(bandwidth=2e6),
+              'drop':dict(drop_rate=1.0),
+              '550':dict(error_550_rate=1.0)}
+FAULTS = ['drop','550']
+
+LATS = np.arange(90.0,-91.0,-1.0)
+LONS = np.arange(0.0,360.0,1.0)
+
+def write_remote_files(root):
+    ''' Populates root with small versions of the files on the AI Weather Quest FTP site.
+    '''
+    rng = np.random.default_rng(0)
+    local_ftp_server.create_remote_layout(root)
+
+    obs_filename, obs_path = retrieve_evaluation_data.obs_filenames(OBS_DATE,'tas')
+    os.makedirs(os.path.join(root,'observations',OBS_DATE))
+    xr.Dataset(data_vars=dict(tas=(['time','lat','lon'],rng.normal(size=(1,181,360)).astype(np.float32)),
+                              time_bnds=(['time','bnds'],np.zeros((1,2)))),
+               coords=dict(time=[np.datetime64('2024-12-30')],lat=LATS,lon=LONS)).to_netcdf(os.path.join(root,obs_path.lstrip('/')))
+
+    clim_filename, clim_path = retrieve_evaluation_data.clim_filenames(OBS_DATE,'tas')
+    os.makedirs(os.path.join(root,'climatologies','2024'))
+    xr.DataArray(np.sort(rng.normal(size=(4,181,360)),axis=0).astype(np.float32),name='tas',dims=['quantile','lat','lon'],
+                 coords=dict(quantile=[0.2,0.4,0.6,0.8],lat=LATS,lon=LONS)).to_netcdf(os.path.join(root,clim_path.lstrip('/')))
+
+    xr.Dataset(data_vars=dict(tas=(['time','latitude','longitude'],rng.normal(size=(2,181,360)).astype(np.float32))),
+               coords=dict(time=[np.datetime64('2020-01-06'),np.datetime64('2020-01-13')],latitude=LATS,longitude=LONS)
+               ).to_netcdf(os.path.join(root,'training_data','tas_sevenday_WEEKLYMEAN_2020.nc'))
+
+    xr.DataArray((rng.random(size=(1,181,360)) > 0.7).astype(np.float32),name='lsm',dims=['time','lat','lon'],
+                 coords=dict(time=[np.datetime64('2024-01-01')],lat=LATS,lon=LONS)).to_netcdf(os.path.join(root,'land_sea_mask_1DEG.nc'))
+
+def forecast_probabilities(lons=LONS,seed=0):
+    rng = np.random.default_rng(seed)
+    probabilities = rng.dirichlet(np.ones(5),size=(181,360)).transpose(2,0,1)
+    return xr.DataArray(probabilities,dims=['quintile','latitude','longitude'],
+                        coords=dict(quintile=[0.2,0.4,0.6,0.8,1.0],latitude=LATS,longitude=lons))
+
+def clear_faults(server):
+    server.drop_rate = 0.0
+    server.error_550_rate = 0.0
+    server.fail_paths = []
+
+def check_fault_was_injected(server,condition):
+    assert server.stats['dropped' if condition == 'drop' else 'injected_550'] > 0
+
+def check_bandwidth_cap(server,started):
+    # the first block goes out straight away, every byte after that is held to the cap
+    num_bytes = server.stats['bytes_sent']+server.stats['bytes_received']
+    assert time.monotonic()-started >= (num_bytes-server.block_size())/server.bandwidth
+
+@pytest.fixture
+def remote_root(tmp_path):
+    root = str(tmp_path/'ftp_root')
+    write_remote_files(root)
+    return root
+
+@pytest.fixture
+def serve(remote_root):
+    ''' Returns a function that starts a local FTP server with the given faults and points the package at it.
+    '''
+    saved_server = dict(ftp_connection.FTP_SERVER)
+    servers = []
+    def start(**faults):
+        server = local_ftp_server.LocalFTPServer(remote_root,password=PASSWORD,seed=0,**faults).start()
+        servers.append(server)
+        ftp_connection.set_ftp_server('127.0.0.1',server.port,timeout=10)
+        return server
+    yield start
+    for server in servers:
+        server.stop()
+    ftp_connection.FTP_SERVER.update(saved_server)
+
+@pytest.fixture
+def workdir(tmp_path,monkeypatch):
+    path = tmp_path/'work'
+    path.mkdir()
+    monkeypatch.chdir(path)
+    return str(path)
+
+@pytest.mark.parametrize('condition',list(CONDITIONS))
+@pytest.mark.parametrize('retrieve, remote_filenames',
+                         [(retrieve_evaluation_data.retrieve_weekly_obs,retrieve_evaluation_data.obs_filenames),
+                          (retrieve_evaluation_data.retrieve_20yr_quintile_clim,retrieve_evaluation_data.clim_filenames)])
+def test_retrieve_evaluation_data(serve,remote_root,workdir,condition,retrieve,remote_filenames):
+    server = serve(**CONDITIONS[condition])
+    cache_dir = os.path.join(workdir,'cache') # created by the retrieve function
+    local_filename, remote_path = remote_filenames(OBS_DATE,'tas')
+    started = time.monotonic()
+
+    if condition in FAULTS:
+        with pytest.raises(ftplib.all_errors):
+            retrieve(OBS_DATE,'tas',PASSWORD,cache_dir=cache_dir)
+        check_fault_was_injected(server,condition)
+        # a failed transfer must not leave anything that would later be opened as a cached download
+        assert os.listdir(cache_dir) == []
+        clear_faults(server)
+
+    data = retrieve(OBS_DATE,'tas',PASSWORD,cache_dir=cache_dir)
+    if condition == 'bandwidth':
+        check_bandwidth_cap(server,started)
+    assert os.listdir(cache_dir) == [local_filename]
+    with open(os.path.join(remote_root,remote_path.lstrip('/')),'rb') as remote, open(os.path.join(cache_dir,local_filename),'rb') as local:
+        assert remote.read() == local.read()
+    assert 'latitude' in data.dims and 'longitude' in data.dims
+
+    # once cached, the file is opened without logging onto the FTP site
+    connections = server.stats['connections']
+    retrieve(OBS_DATE,'tas',PASSWORD,cache_dir=cache_dir)
+    assert server.stats['connections'] == connections
+
+# downloads saved to the working directory, with the saved filename and expected shape
+WORKDIR_DOWNLOADS = {'training_data':(lambda: retrieve_training_data.retrieve_annual_training_data(2020,'tas',PASSWORD)['tas'],'tas_sevenday_WEEKLYMEAN_2020.nc',(2,181,360)),
+                     'land_sea_mask':(lambda: retrieve_evaluation_data.retrieve_land_sea_mask(PASSWORD),'land_sea_mask_1DEG.nc',(181,360))}
+
+@pytest.mark.parametrize('condition',list(CONDITIONS))
+@pytest.mark.parametrize('download',list(WORKDIR_DOWNLOADS))
+def test_retrieve_to_workdir(serve,workdir,condition,download):
+    retrieve, local_filename, shape = WORKDIR_DOWNLOADS[download]
+    server = serve(**CONDITIONS[condition])
+    started = time.monotonic()
+
+    if condition in FAULTS:
+        with pytest.raises(ftplib.all_errors):
+            retrieve()
+        check_fault_was_injected(server,condition)
+        assert os.listdir(workdir) == []
+        clear_faults(server)
+
+    data = retrieve()
+    if condition == 'bandwidth':
+        check_bandwidth_cap(server,started)
+    assert data.shape == shape
+    assert os.listdir(workdir) == [local_filename]
+
+@pytest.mark.parametrize('condition',list(CONDITIONS))
+def test_forecast_submission(serve,remote_root,workdir,condition):
+    server = serve(**CONDITIONS[condition])
+    final_filename = f'tas_{FC_START_DATE}_p1_team_model.nc'
+    remote_filename = os.path.join(remote_root,'forecast_submissions',FC_START_DATE,final_filename)
+    # a file of the same name in the working directory (e.g. the directory watched by submission_service) must be left alone
+    with open(final_filename,'wb') as f:
+        f.write(b'team file')
+    fc = forecast_probabilities()
+    started = time.monotonic()
+
+    if condition in FAULTS:
+        with pytest.raises(ftplib.all_errors):
+            forecast_submission.AI_WQ_forecast_submission(fc,PASSWORD,'tas',FC_START_DATE,1,'team','model')
+        check_fault_was_injected(server,condition)
+        assert not os.path.exists(remote_filename)
+        clear_faults(server)
+
+    forecast_submission.AI_WQ_forecast_submission(fc,PASSWORD,'tas',FC_START_DATE,1,'team','model')
+    if condition == 'bandwidth':
+        check_bandwidth_cap(server,started)
+    with open(final_filename,'rb') as f:
+        assert f.read() == b'team file'
+    assert os.listdir(workdir) == [final_filename]
+    with xr.open_dataarray(remote_filename) as submitted:
+        np.testing.assert_allclose(submitted.values,fc.values)
+
+@pytest.mark.parametrize('condition',list(CONDITIONS))
+def test_evaluation_prefetcher(serve,workdir,condition):
+    server = serve(**CONDITIONS[condition])
+    cache_dir = os.path.join(workdir,'cache')
+    prefetcher = prefetch_evaluation_data.EvaluationPrefetcher(PASSWORD,cache_dir,variables=['tas'])
+    prefetcher.add_forecast(FC_START_DATE,fc_periods=['1'])
+    assert len(prefetcher.pending) == 2
+    after_obs_week = datetime(2025,1,7)
+
+    if condition == 'drop':
+        with pytest.raises(ftplib.all_errors):
+            prefetcher.run_once(now=after_obs_week)
+    elif condition == '550':
+        assert prefetcher.run_once(now=after_obs_week) == 0 # treated as not yet on the FTP site
+    if condition in FAULTS:
+        check_fault_was_injected(server,condition)
+        assert os.listdir(cache_dir) == []
+        assert len(prefetcher.pending) == 2
+        clear_faults(server)
+
+    assert prefetcher.run_once(now=after_obs_week) == 2
+    assert prefetcher.pending == {}
+    assert sorted(os.listdir(cache_dir)) == sorted([retrieve_evaluation_data.obs_filenames(OBS_DATE,'tas')[0],
+                                                    retrieve_evaluation_data.clim_filenames(OBS_DATE,'tas')[0]])
+
+@pytest.mark.parametrize('condition',list(CONDITIONS))
+def test_submission_service(serve,remote_root,workdir,condition):
+    server = serve(**CONDITIONS[condition])
+    # run from inside the watched directory. The mslp forecast uses longitudes from -180 to 180.
+    filenames = {f'tas_{FC_START_DATE}_p1_team_model.nc':forecast_probabilities(seed=1),
+                 f'mslp_{FC_START_DATE}_p1_team_model.nc':forecast_probabilities(lons=np.arange(-180.0,180.0,1.0),seed=2)}
+    for filename, fc in filenames.items():
+        fc.to_netcdf(filename)
+    contents = {filename: open(filename,'rb').read() for filename in filenames}
+    service = submission_service.SubmissionService(PASSWORD,'.',settle_time=0.0,max_retries=2,retry_delay=1.0)
+    remote_dir = os.path.join(remote_root,'forecast_submissions',FC_START_DATE)
+
+    if condition in FAULTS:
+        started = time.monotonic()
+        assert service.scan() == {filename: 'retrying' for filename in filenames}
+        assert time.monotonic()-started < service.retry_delay # failed transfers are rescheduled, the scan does not wait for them
+        check_fault_was_injected(server,condition)
+        assert not os.path.exists(remote_dir) or os.listdir(remote_dir) == []
+        assert service.scan() == {} # not due yet
+        for filename in filenames:
+            assert service.status[filename]['attempts'] == 1
+            assert service.status[filename]['next_attempt'] > time.time()
+        clear_faults(server)
+        # retried once due, without the files being modified
+        time.sleep(max(0.0,max(service.status[filename]['next_attempt'] for filename in filenames)-time.time()))
+
+    assert service.scan() == {filename: 'submitted' for filename in filenames}
+    service.close()
+    for filename in filenames:
+        with open(filename,'rb') as f:
+            assert f.read() == contents[filename] # watched files are never overwritten or deleted
+    assert sorted(os.listdir(remote_dir)) == sorted(filenames)
+    mslp_fc = filenames[f'mslp_{FC_START_DATE}_p1_team_model.nc']
+    with xr.open_dataarray(os.path.join(remote_dir,f'mslp_{FC_START_DATE}_p1_team_model.nc')) as submitted:
+        np.testing.assert_allclose(submitted.values,mslp_fc.assign_coords(longitude=mslp_fc['longitude'] % 360.0).sortby('longitude').values)
+    with open(service.status_file) as f:
+        status = json.load(f)
+    assert {status[filename]['status'] for filename in filenames} == {'submitted'}
+
+def test_submission_service_continues_after_unexpected_error(serve,remote_root,workdir,monkeypatch):
+    serve()
+    check_and_convert_longitudes = check_fc_submission.check_and_convert_longitudes
+    def fail_on_mslp(da):
+        if da.attrs.get('fail'):
+            raise RuntimeError('unexpected failure')
+        return check_and_convert_longitudes(da)
+    monkeypatch.setattr(check_fc_submission,'check_and_convert_longitudes',fail_on_mslp)
+    forecast_probabilities(seed=1).to_netcdf(f'tas_{FC_START_DATE}_p1_team_model.nc')
+    forecast_probabilities(seed=2).assign_attrs(fail=1).to_netcdf(f'mslp_{FC_START_DATE}_p1_team_model.nc')
+
+    service = submission_service.SubmissionService(PASSWORD,'.',settle_time=0.0,retry_delay=0.0)
+    results = service.scan()
+    service.close()
+    assert results == {f'mslp_{FC_START_DATE}_p1_team_model.nc':'failed',f'tas_{FC_START_DATE}_p1_team_model.nc':'submitted'}
+    assert 'RuntimeError' in service.status[f'mslp_{FC_START_DATE}_p1_team_model.nc']['message']
+    assert os.listdir(os.path.join(remote_root,'forecast_submissions',FC_START_DATE)) == [f'tas_{FC_START_DATE}_p1_team_model.nc']